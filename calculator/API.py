@@ -8,55 +8,202 @@
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse
-from ETC import exposure_time_calculator
+from ETC import exposure_time_calculator, _ROW_RESULTS, _parse_list
+from Cache import bounded_cache
+import Metrics
+from astropy import units as u
+from hashlib import sha1
 import json
 from re import sub  # Processing regular expressions
 from base64 import b64decode
-from numpy import NaN, isnan
+from itertools import chain
+from numpy import NaN, asarray, ndarray, savez, floating, isnan
+from io import BytesIO
+from struct import pack
+from gzip import compress as gzip_compress
+from zlib import compress as zlib_compress, compressobj, DEFLATED, Z_SYNC_FLUSH
 from datetime import datetime
-from os import getpid
+from os import getpid, fork, wait, kill, _exit
+from signal import signal, SIGTERM, SIG_DFL
 from sys import argv
 
 
 hostName = "0.0.0.0"
 serverPort = 50006 
-
-
+serverWorkers = 1
+# Bounds for cache of responses, and how long clients may reuse a response in seconds
+resultCacheEntries = 256
+resultCacheBytes = 64 * 2**20
+resultMaxAge = 3600
+# Responses smaller than this many bytes aren't compressed
+compressionMinBytes = 1024
+# Time each stage of every request, for the /metrics endpoint, disable w/ command line argument --no-metrics
+metricsEnabled = True
+
+
+
+def get_return_values(query):
+    # Informative error if no return values specified
+    if not 'return' in query.keys():
+        raise ValueError('Must specify return values, i.e. return=[exposure]')
+
+    # Remove return values from query
+    if isinstance(query['return'], list):
+        return_vals = { x:[] for x in query['return'] }
+    else:
+        return_vals = { query['return'] : [] }
+    del query['return']
+    return return_vals
+
+def get_results(calculator, return_vals):
+    # Get the requested values
+    with Metrics.stage('results'):
+        for key in return_vals.keys():
+            if key == 'parameters':
+                # If parameters were requested, retrieve them
+                return_vals[key] = calculator.get_parameters()
+            elif key == 'parameter_options':
+                return_vals[key] = calculator.get_parameter_options()
+            elif key == 'nonlinear_depth_adu':
+                return_vals[key] = asarray([calculator.instrument.nonlinear_depth.to('adu').value], dtype=float)
+            elif key == 'timings':
+                continue  # Filled in last, so that it includes the other results
+            else:
+                # Kept as arrays until the response is encoded in the requested format
+                return_vals[key] = asarray(vars(calculator)[key].value, dtype=float)
+    if 'timings' in return_vals.keys():
+        return_vals['timings'] = Metrics.timings()
+    return return_vals
+
+def requests_timings(query):
+    # Whether any query asks for timings to be returned
+    queries = query if isinstance(query, list) else [query]
+    return any(isinstance(q, dict) and 'timings' in (q.get('return') if isinstance(q.get('return'), list) else [q.get('return')]) for q in queries)
+
+def instrument_label(query):
+    # Instrument that a request is counted under in metrics, limited to known instruments so that queries can't add arbitrary labels
+    if isinstance(query, list):
+        return 'batch'
+    # Read from the query rather than the calculator, so that responses served from the cache are counted under the same instrument
+    # Matches how ETC.set_parameter() reads the instrument, w/ name (as sent by the GUI) coerced to instrument.name, and names in any case
+    name = etc.config.defaults.instrument
+    for key, value in query.items():
+        if key in ['instrument', 'instrument.name', 'name']:
+            name = value
+    name = name.lower() if isinstance(name, str) else None
+    return name if name in etc.config.instruments else 'other'
 
 def process_request(query):
     if len(query) == 0:
         return '', True
 
     try:
-        # Informative error if no return values specified
-        if not 'return' in query.keys():
-            raise ValueError('Must specify return values, i.e. return=[exposure]')
+        return_vals = get_return_values(query)
+        # Calculate on a copy of the shared etc, so that nothing needs to be reset afterwards
+        calculator = etc.calculate(query)
+        return get_results(calculator, return_vals), False
+    except Exception as e:
+        # For a more informative (but messier) error msg, use repr(e)
+        return f'An error occured while processing your request<br>{str(e)}<br><br>', True
 
-        # Remove return values from query
-        if isinstance(query['return'], list):
-            return_vals = { x:[] for x in query['return'] }
-        else:
-            return_vals = { query['return'] : [] }
-        del query['return']
+def process_stream(query):
+    if len(query) == 0:
+        return '', True
 
-        etc.set_parameters(query)
-        # Get the requested values
+    try:
+        return_vals = get_return_values(query)
+        calculator = etc.fork()
+        calculator.set_parameters(query, run_calculator=False)
+        rows = calculator.calculate_rows()
+        # Calculate the first row and values shared by all rows now, so that errors are reported before the response starts
+        first = next(rows)
+        shared = {}
         for key in return_vals.keys():
             if key == 'parameters':
-                # If parameters were requested, retrieve them
-                return_vals[key] = etc.get_parameters()
-            elif key == 'nonlinear_depth_adu':
-                return_vals[key] = [etc.instrument.nonlinear_depth.to('adu').value]
-            else:
-                return_vals[key] = vars(etc)[key].value.tolist()
-                # Coerce to valid JSON format by converting NaN to string
-                return_vals[key] = replaceNaN(return_vals[key], 'NaN')
-
-        return return_vals, False
+                shared[key] = calculator.get_parameters()
+            elif key not in _ROW_RESULTS:
+                shared.update(get_results(first, {key: []}))
     except Exception as e:
         # For a more informative (but messier) error msg, use repr(e)
         return f'An error occured while processing your request<br>{str(e)}<br><br>', True
 
+    def lines():
+        # Newline delimited JSON, w/ a line of values shared by all rows, then a line for each exposure or signal to noise ratio
+        yield encode_json(shared) + '\n'
+        try:
+            for row in chain([first], rows):
+                yield encode_json({key: asarray(vars(row)[key].value, dtype=float)[0] for key in return_vals.keys() if key in _ROW_RESULTS}) + '\n'
+        except Exception as e:
+            yield encode_json({'error': str(e)}) + '\n'
+
+    return lines(), False
+
+def process_batch(queries):
+    if len(queries) == 0:
+        return '', True
+
+    # Response has an entry for each query, w/ either the requested values or an error message
+    response = [None] * len(queries)
+    requests = []
+    for idx, query in enumerate(queries):
+        try:
+            if not isinstance(query, dict):
+                raise ValueError('Each query in a batch must be a JSON object')
+            requests.append((idx, get_return_values(query), query))
+        except Exception as e:
+            response[idx] = {'error': str(e)}
+
+    # Queries are grouped by etc, so that results are calculated once for queries that share an instrument, atmosphere, and source
+    calculators = etc.calculate_batch([query for _, _, query in requests])
+    for (idx, return_vals, _), calculator in zip(requests, calculators):
+        try:
+            if isinstance(calculator, Exception):
+                raise calculator
+            response[idx] = get_results(calculator, return_vals)
+        except Exception as e:
+            response[idx] = {'error': str(e)}
+
+    return response, False
+
+def quantity_parameter(key):
+    # Whether a parameter's value is a quantity, going by the type of its current value in etc, w/ names resolved as in ETC.set_parameter()
+    # Parameters that aren't found (i.e. those of another source type) aren't treated as quantities, which only means their equivalent values are cached separately
+    key = {'instrument': 'instrument.name', 'source': 'source.type'}.get(key, key)
+    objects = {'instrument': etc.instrument, 'source': etc.source, 'atmosphere': etc.atmosphere}
+    owner, _, name = key.rpartition('.')
+    if owner in objects.keys():
+        return isinstance(vars(objects[owner]).get(name), u.Quantity)
+    if key in vars(etc).keys():
+        return isinstance(vars(etc)[key], u.Quantity)
+    return any(isinstance(vars(obj).get(key), u.Quantity) for obj in objects.values())
+
+def canonical_value(value):
+    # Convert quantities to SI, so that equivalent values (i.e. 1hr and 3600s) have the same form
+    value = _parse_list(value)
+    if isinstance(value, list):
+        return [canonical_value(x) for x in value]
+    try:
+        quantity = u.Quantity(value).si
+        return f'{quantity.value!r} {quantity.unit}'
+    except Exception:
+        return value
+
+def canonical_query(query):
+    # Key for a query or batch of queries, w/ keys sorted and units normalized
+    if isinstance(query, list):
+        query = [canonical_query(q) if isinstance(q, dict) else q for q in query]
+    else:
+        # Keep the order of return values, which sets the order of the response, and option or name strings (i.e. band K or grating 1200G) as they are
+        query = {key: canonical_value(val) if quantity_parameter(key) and 'b64' not in key else val for key, val in query.items()}
+    return sha1(json.dumps(query, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def etag_matches(header, etag):
+    # If-None-Match may be *, or a comma-separated list of ETags, any of which may be weak (W/"...")
+    if header is None:
+        return False
+    tags = [x.strip() for x in header.split(',')]
+    return '*' in tags or etag in [x[2:] if x.startswith('W/') else x for x in tags]
+
 def text2html(text):
     text = text.replace('&', '&#38;')
     text = text.replace(' ', '&nbsp;')
@@ -64,14 +211,63 @@ def text2html(text):
     text = text.replace('\n', '<br>')
     return '<html><body style="font-family: monospace;">' + text + '</body></html>'
 
-def replaceNaN(array, replacement):
-    new_array = array
-    for idx, item in enumerate(array):
-        if isinstance(item, list):
-            new_array[idx] = replaceNaN(item, replacement)
+def encode_json(response):
+    if isinstance(response, list):
+        return '[' + ', '.join(encode_json(item) for item in response) + ']'
+    if isinstance(response, dict):
+        return '{' + ', '.join(f'{json.dumps(key, ensure_ascii=False)}: {encode_json(val)}' for key, val in response.items()) + '}'
+    if isinstance(response, ndarray):
+        # Coerce to valid JSON format by converting NaN to string, arrays only contain numbers so this can't change anything else
+        return json.dumps(response.tolist()).replace('NaN', '"NaN"')
+    if isinstance(response, (float, floating)) and isnan(response):
+        # Single values (i.e. each row of a streamed response) are coerced the same way
+        return '"NaN"'
+    return json.dumps(response, ensure_ascii=False)
+
+def flatten(response):
+    # List of (name, value) pairs, w/ batch results named by their index, i.e. 0/exposure
+    if isinstance(response, list):
+        return [(f'{idx}/{name}', val) for idx, item in enumerate(response) for name, val in flatten(item)]
+    return list(response.items())
+
+def encode_npz(response):
+    # Arrays saved as is, anything else (i.e. parameters or errors) saved as a JSON string
+    values = {name: val if isinstance(val, ndarray) else asarray(encode_json(val)) for name, val in flatten(response)}
+    buffer = BytesIO()
+    savez(buffer, **values)
+    return buffer.getvalue()
+
+def encode_raw(response):
+    # Little-endian uint32 header length, then a JSON header, then the arrays as little-endian float64, one after another
+    # Header is {"arrays": [{"name", "shape", "dtype", "offset"}], "values": {name: value}}, w/ offsets in bytes from the end of the header
+    header = {'arrays': [], 'values': {}}
+    data = []
+    offset = 0
+    for name, val in flatten(response):
+        if isinstance(val, ndarray):
+            val = val.astype('<f8', copy=False)
+            header['arrays'].append({'name': name, 'shape': list(val.shape), 'dtype': '<f8', 'offset': offset})
+            data.append(val.tobytes())
+            offset += val.nbytes
         else:
-            new_array[idx] = replacement if isnan(item) else item
-    return new_array
+            header['values'][name] = val
+    header = bytes(encode_json(header), 'utf-8')
+    return pack('<I', len(header)) + header + b''.join(data)
+
+# Encoders for each supported content type, the first is the default
+encoders = {
+    'application/json': lambda response: bytes(encode_json(response), 'utf-8'),
+    'application/x-npz': encode_npz,
+    'application/octet-stream': encode_raw
+}
+
+def negotiate(accept, options):
+    # Return the first option listed in an Accept or Accept-Encoding header, ignoring parameters and anything w/ q=0
+    for item in (accept or '').split(','):
+        name, *parameters = [x.strip() for x in item.split(';')]
+        if name in options and not any(x.replace(' ', '') in ['q=0', 'q=0.0'] for x in parameters):
+            return name
+    return None
 
 def query2dict(query):
     query = query.split("&")
@@ -99,26 +295,77 @@ def sanitize_input(text):
     # Remove all non-allowed characters from string
     return sub(not_whitelist,'', text)
 
+def sanitize_batch(queries):
+    # Apply the same whitelist to every key and value in a JSON batch of queries
+    def sanitize(value):
+        if isinstance(value, list):
+            return [sanitize(x) for x in value]
+        return sanitize_input(value) if isinstance(value, str) else value
+    return [{sanitize_input(str(key)): sanitize(val) for key, val in query.items()} if isinstance(query, dict) else query for query in queries]
+
 
 
 class APIServer(BaseHTTPRequestHandler):
 
+    # HTTP/1.1 is needed for chunked responses
+    protocol_version = 'HTTP/1.1'
+
+    def end_headers(self):
+        # Close each connection after responding, so that an idle client can't hold onto a worker
+        self.send_header('Connection', 'close')
+        super().end_headers()
+
     def do_OPTIONS(self):
         self.send_response(200, "ok")
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header("Access-Control-Allow-Headers", "X-Requested-With")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "If-None-Match")
         self.end_headers()
 
     def respond(self, query):
-        response, error = process_request(query)
-        if len(response) == 0:
+        # Requests are only timed if metrics are enabled or timings were requested
+        timed = metricsEnabled or requests_timings(query)
+        if timed:
+            Metrics.begin()
+        error = True
+        try:
+            error = self.respond_query(query)
+        finally:
+            if timed:
+                Metrics.end(instrument_label(query), error)
+
+    def respond_query(self, query):
+        # Returns whether the query failed
+        # Single queries can also be streamed
+        formats = list(encoders.keys()) + (['application/x-ndjson'] if isinstance(query, dict) else [])
+        content_type = negotiate(self.headers.get('Accept'), formats) or 'application/json'
+        encoding = negotiate(self.headers.get('Accept-Encoding'), ['gzip', 'deflate'])
+        # Reuse the response for an identical query in the same format, skipping the calculation entirely
+        # Streamed responses aren't cached, so that memory use doesn't grow w/ the size of the result, nor are timings
+        with Metrics.stage('cache_lookup'):
+            key = f'{canonical_query(query)} {content_type} {encoding}' if len(query) > 0 and content_type != 'application/x-ndjson' and not requests_timings(query) else None
+            cached = results.get(key) if key is not None else None
+        if cached is not None:
+            response, error = cached, False
+        elif content_type == 'application/x-ndjson':
+            response, error = process_stream(query)
+        elif isinstance(query, list):
+            response, error = process_batch(query)
+        else:
+            response, error = process_request(query)
+
+        if content_type == 'application/x-ndjson' and not error:
+            with Metrics.stage('stream'):
+                self.respond_stream(response, encoding)
+        elif len(response) == 0:
             self.send_response(200)
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Content-type', 'text/html')
             self.end_headers()
             self.wfile.write(bytes(self.usage, 'utf-8'))
+            error = False  # Usage instructions for an empty query aren't an error
         elif error:
             self.send_response(400)
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -126,11 +373,101 @@ class APIServer(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(bytes(response, 'utf-8'))
         else:
+            if cached is None:
+                with Metrics.stage('encode'):
+                    body = encoders[content_type](response)
+                    if encoding == 'gzip' and len(body) >= compressionMinBytes:
+                        body = gzip_compress(body, compresslevel=6)
+                    elif encoding == 'deflate' and len(body) >= compressionMinBytes:
+                        body = zlib_compress(body, 6)
+                    else:
+                        encoding = None
+                    response = (body, '"' + sha1(body).hexdigest() + '"', encoding)
+                if key is not None:
+                    results.put(key, response, size=len(body))
+            body, etag, encoding = response
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', f'public, max-age={resultMaxAge}')
+                self.send_header('Vary', 'Accept, Accept-Encoding')
+                self.end_headers()
+                return False
             self.send_response(200)
             self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header("Content-type", "application/json")
+            self.send_header('Access-Control-Expose-Headers', 'ETag')
+            self.send_header("Content-type", content_type)
+            if encoding is not None:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'public, max-age={resultMaxAge}')
+            self.send_header('Vary', 'Accept, Accept-Encoding')
             self.end_headers()
-            self.wfile.write(bytes(json.dumps(response, ensure_ascii=False), 'utf-8'))
+            with Metrics.stage('write'):
+                self.wfile.write(body)
+        return error
+
+    def respond_stream(self, lines, encoding):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header("Content-type", 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        # Compress w/ a sync flush after each line, so that clients can decode each chunk when it arrives
+        compressor = compressobj(6, DEFLATED, {'gzip': 31, 'deflate': 15}[encoding]) if encoding is not None else None
+        for line in lines:
+            data = bytes(line, 'utf-8')
+            if compressor is not None:
+                data = compressor.compress(data) + compressor.flush(Z_SYNC_FLUSH)
+            self.write_chunk(data)
+        if compressor is not None:
+            self.write_chunk(compressor.flush())
+        self.write_chunk(b'')  # Empty chunk marks end of response
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def respond_cache_stats(self):
+        # Statistics for this process's response cache
+        stats = {
+            'entries': len(results),
+            'max_entries': results.max_entries,
+            'bytes': results.bytes,
+            'max_bytes': results.max_bytes,
+            'hits': results.hits,
+            'misses': results.misses,
+            'hit_rate': results.hits / max(results.hits + results.misses, 1),
+            'system_responses': {
+                'entries': len(etc._system_responses),
+                'max_entries': etc._system_responses.max_entries,
+                'bytes': etc._system_responses.bytes,
+                'hits': etc._system_responses.hits,
+                'misses': etc._system_responses.misses
+            },
+            'atmosphere': etc.atmosphere.memory_report(),
+            'pid': getpid()
+        }
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header("Content-type", "application/json")
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(bytes(json.dumps(stats), 'utf-8'))
+
+    def respond_metrics(self):
+        # Request counts and latency histograms by stage and instrument for this process
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header("Content-type", "application/json")
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(bytes(json.dumps({**Metrics.report(), 'pid': getpid()}), 'utf-8'))
 
     def do_POST(self):
         with open('src/static/api_instructions.txt', 'r') as file:
@@ -138,19 +475,28 @@ class APIServer(BaseHTTPRequestHandler):
 
         try:
             query = self.rfile.read( int(self.headers.get('Content-Length')) ).decode('utf-8')
-            query = sanitize_input(query)
-            query = query2dict(query)
+            # A JSON array of queries is a batch, anything else is a single query
+            if query.lstrip().startswith('['):
+                query = sanitize_batch(json.loads(query))
+            else:
+                query = sanitize_input(query)
+                query = query2dict(query)
         except:
             query = {}
         
-        self.respond(query)    
-        # Reset etc for future API call
-        etc.reset_parameters()
+        self.respond(query)
 
     def do_GET(self):
         with open('src/static/api_instructions.txt', 'r') as file:
             self.usage = text2html(file.read())
 
+        if urlparse(self.path).path.rstrip('/').endswith('/cache'):
+            self.respond_cache_stats()
+            return
+        if urlparse(self.path).path.rstrip('/').endswith('/metrics'):
+            self.respond_metrics()
+            return
+
         try:
             query = urlparse(self.path).query
             query = sanitize_input(query)
@@ -159,33 +505,79 @@ class APIServer(BaseHTTPRequestHandler):
             query = {}
             
         self.respond(query)
-        # Reset etc for future API call
-        etc.reset_parameters()
+
+
+def serve(webServer):
+    try:
+        webServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def start_worker(webServer):
+    # Fork a worker that serves requests from the shared socket, w/ its own copy of the already loaded etc
+    pid = fork()
+    if pid == 0:
+        signal(SIGTERM, SIG_DFL)
+        serve(webServer)
+        _exit(0)
+    return pid
 
 
 if __name__ == "__main__":
 
-    # Handle command line argument to specify port
-    if len(argv) > 2:
-        print('Invalid number of arguments, must be 0 or 1')
+    # Handle command line arguments to specify port and number of worker processes, and whether to record metrics
+    if '--no-metrics' in argv:
+        metricsEnabled = False
+        argv = [x for x in argv if x != '--no-metrics']
+    if len(argv) > 3:
+        print('Invalid number of arguments, must be 0, 1, or 2')
         exit(-1)
-    elif len(argv) == 2:
-        if argv[-1].isdigit():
-            serverPort = int(argv[-1])
+    if len(argv) >= 2:
+        if argv[1].isdigit():
+            serverPort = int(argv[1])
         else:
-            print('Invalid port number', argv[-1])
+            print('Invalid port number', argv[1])
+            exit(-1)
+    if len(argv) == 3:
+        if argv[2].isdigit() and int(argv[2]) > 0:
+            serverWorkers = int(argv[2])
+        else:
+            print('Invalid number of workers', argv[2])
             exit(-1)
 
 
     etc = exposure_time_calculator()  # Initialize etc
+    Metrics.enabled = metricsEnabled
+    # Report memory used by atmosphere data, of which each worker only reads the window for its current instrument
+    memory = etc.atmosphere.memory_report()
+    print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Atmosphere data {memory["data_bytes"]/2**20:.1f} MiB {memory["storage_dtype"]}' +
+          f'{" memory-mapped" if memory["memory_mapped"] else ""}, windows {", ".join(f"{x} ({y/2**20:.1f} MiB)" for x, y in memory["window_bytes"].items())}" {getpid()} -')
+    results = bounded_cache(resultCacheEntries, resultCacheBytes)  # Responses by canonical query
 
     webServer = HTTPServer((hostName, serverPort), APIServer)
-    print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Server started" {getpid()} -')
 
-    try:
-        webServer.serve_forever()
-    except KeyboardInterrupt:
-        pass
+    if serverWorkers == 1:
+        print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Server started" {getpid()} -')
+        serve(webServer)
+    else:
+        # Workers all accept connections from the same listening socket, so the kernel hands each request to an idle worker
+        # Data loaded above is shared between workers by copy-on-write, rather than loaded again for each one
+        workers = [start_worker(webServer) for _ in range(serverWorkers)]
+        signal(SIGTERM, lambda signum, frame: exit(0))  # Stop workers below when the server is stopped
+        print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Server started" {getpid()} -')
+        try:
+            while True:
+                # Replace any worker that exits unexpectedly
+                pid, _ = wait()
+                workers.remove(pid)
+                workers.append(start_worker(webServer))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            for pid in workers:
+                kill(pid, SIGTERM)
+            for _ in workers:
+                wait()
 
     webServer.server_close()
-    print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Server stopped" {getpid()} -')
\ No newline at end of file
+    print(f'{hostName}:{serverPort} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "Server stopped" {getpid()} -')
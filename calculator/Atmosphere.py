@@ -7,150 +7,291 @@
 
 from astropy import units as u
 from astropy.table import Table
-import yaml
-from os import listdir
-from numpy import arange, zeros
+from astropy.io import fits
+import Snapshot
+import Config
+from Config import quantity, quantities
+from os import listdir, makedirs, replace, getpid, stat
+from numpy import arange, zeros, interp, isclose, array_equal, save, load, savez, searchsorted, dtype, memmap
+from zlib import crc32
+import json
 # Including scipy introduces an additional dependency to project, but is significantly faster implementing manually
 from scipy.interpolate import RegularGridInterpolator
 from warnings import warn
+from Cache import bounded_cache
 
 
 
+# Values in atmosphere_config.yaml, see Config.py
+_CONFIG_SCHEMA = {
+    'defaults': {
+        'seeing': quantity(u.arcsec),
+        'airmass': quantity(u.dimensionless_unscaled),
+        'water_vapor': quantity(u.mm)
+    },
+    'file_directory': str,
+    'cache_directory': str,
+    'emission_filepath': str,
+    'transmission_filepath': str,
+    'airmass_index': quantities(u.dimensionless_unscaled),
+    'water_vapor_index': quantities(u.mm),
+    'wavelength_index': quantities(u.angstrom),
+    'storage_dtype': str,
+    'windowed': bool,
+    'spectrum_cache_size': int
+}
+
+
+def _read_config_file(filepath):
+    return Config.load(filepath, _CONFIG_SCHEMA)
+
+
 class atmosphere:
 
     global _CONFIG_FILEPATH; _CONFIG_FILEPATH = 'calculator/atmosphere/atmosphere_config.yaml'
 
     def _mount_config(self, config_path):
-        # From https://www.geeksforgeeks.org/convert-nested-python-dictionary-to-object/
-        def _dict2obj(d):
-            # If list, recursively unpack
-            if isinstance(d, list):
-                d = [_dict2obj(x) for x in d]
-            # If not list or dictionary, return object
-            if not isinstance(d, dict):
-                return d
-            # Otherwise, create dummy object
-            class Foo:
-                pass
-            obj = Foo()
-            # Loop over dictionary items and add to object
-            for x in d:
-                obj.__dict__[x] = _dict2obj(d[x])
-            return obj
-        # Open config file, convert & mount to self
-        config = yaml.safe_load(open(config_path))
-        config = _dict2obj(config)
-        self.config = config
+        self.config = Snapshot.read(config_path, _read_config_file)
 
 
     def _load_files(self):
-        self._water_vapor_index = [u.Quantity(x).to(u.mm).value for x in self.config.water_vapor_index] * u.mm
-        self._airmass_index = u.Quantity(self.config.airmass_index)
-        self.config.wavelength_index = [u.Quantity(x).to(u.angstrom) for x in self.config.wavelength_index]
-        self._wavelength_index = arange(
-            u.Quantity(self.config.wavelength_index[0]).value,
-            u.Quantity(self.config.wavelength_index[1]).value,
-            u.Quantity(self.config.wavelength_index[2]).value
-        ) * u.angstrom  # np.arange doesn't support units, see https://github.com/astropy/astropy/issues/11582
-        self._transmission = zeros([len(self._airmass_index), len(self._water_vapor_index), len(self._wavelength_index)])
-        self._emission = zeros([len(self._airmass_index), len(self._water_vapor_index), len(self._wavelength_index)])
-        # Iterate through directory, filling in self._transmission and self._emission arrays
-        for i, filename in enumerate(listdir(self.config.file_directory)):
-            #print('\rATMOSPHERE: Reading file '+str(i+1)+'/'+str(len(listdir(self.config.file_directory))), end='')
+        self._water_vapor_index = self.config.water_vapor_index
+        self._airmass_index = self.config.airmass_index
+        self._wavelength_index = arange(*self.config.wavelength_index.value) * u.angstrom  # np.arange doesn't support units, see https://github.com/astropy/astropy/issues/11582
+
+        # Use compiled cache if it was built from the same files, otherwise read atmosphere files and rebuild it
+        if not self._read_cache():
+            self._read_files()
+            self._write_cache()
+
+        # Interpolators over (airmass, water vapor) are built once for each window of self._wavelength_index, see _get_interpolator()
+        # Shared w/ forked copies, so each window is built once per process
+        self._interpolators = {}
+        self._window = (0, len(self._wavelength_index))
+        # Interpolated spectra for recently used (airmass, water vapor) pairs and windows
+        self._spectra = bounded_cache(self.config.spectrum_cache_size)
+
+
+    def _read_files(self):
+        self._transmission = zeros([len(self._airmass_index), len(self._water_vapor_index), len(self._wavelength_index)], dtype=self.config.storage_dtype)
+        self._emission = zeros([len(self._airmass_index), len(self._water_vapor_index), len(self._wavelength_index)], dtype=self.config.storage_dtype)
+        # Fill in self._transmission and self._emission arrays, w/ grid cells from the manifest instead of each file's metadata
+        for filename, entry in self._manifest.items():
             try:
-                if filename.startswith(self.config.transmission_filepath):
-                    data = Table.read(self.config.file_directory+'/'+filename, format='fits')
-                    self._transmission[
-                        [x == u.Quantity(data.meta['AIRMASS']) for x in self._airmass_index], 
-                        [x == u.Quantity(data.meta['VAPOR']) for x in self._water_vapor_index],
-                        :
-                    ] = data['transmission'].to('')
-                if filename.startswith(self.config.emission_filepath):
-                    data = Table.read(self.config.file_directory+'/'+filename, format='fits')
-                    self._emission[
-                        [x == u.Quantity(data.meta['AIRMASS']) for x in self._airmass_index], 
-                        [x == u.Quantity(data.meta['VAPOR']) for x in self._water_vapor_index], 
-                        :
-                    ] = data['flux'].to('photon/(s arcsec^2 nm m^2)')
+                data = Table.read(self.config.file_directory+'/'+filename, format='fits')
+                if entry['kind'] == 'transmission':
+                    self._transmission[self._grid_cell(entry) + (slice(None),)] = data['transmission'].to('').value
+                else:
+                    self._emission[self._grid_cell(entry) + (slice(None),)] = data['flux'].to('photon/(s arcsec^2 nm m^2)').value
             except ValueError:
                 raise ValueError('ERROR: In atmosphere._load_files() -- invalid file contents')
-        #print()  # newline for console output
+
+
+    def _grid_cell(self, entry):
+        # Get (airmass, water vapor) indices matching a manifest entry, compared as floats instead of w/ quantities
+        return (
+            int(isclose(self.config.airmass_index.to(u.dimensionless_unscaled).value, entry['airmass']).argmax()),
+            int(isclose(self.config.water_vapor_index.to(u.mm).value, entry['water_vapor']).argmax())
+        )
+
+
+    def _read_manifest(self):
+        # Index of atmosphere files as {filename: {kind, airmass, water_vapor, size, mtime_ns, checksum}}, built from FITS headers only
+        # Saved in cache_directory and reused for each file whose size and modification time are unchanged
+        filepath = self.config.cache_directory+'/manifest.json'
+        try:
+            with open(filepath) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = {}
+        manifest = {}
+        for filename in sorted(listdir(self.config.file_directory)):
+            if filename.startswith(self.config.transmission_filepath):
+                kind = 'transmission'
+            elif filename.startswith(self.config.emission_filepath):
+                kind = 'emission'
+            else:
+                continue
+            status = stat(self.config.file_directory+'/'+filename)
+            entry = saved.get(filename)
+            if entry is None or entry['kind'] != kind or (entry['size'], entry['mtime_ns']) != (status.st_size, status.st_mtime_ns):
+                entry = self._read_header(filename, kind)
+                entry.update({'size': status.st_size, 'mtime_ns': status.st_mtime_ns})
+            manifest[filename] = entry
+        if manifest != saved:
+            self._write_manifest(manifest)
+        return manifest
+
+
+    def _read_header(self, filename, kind):
+        # Read airmass and water vapor from the table header alone, and checksum the file so the compiled cache can tell if it changed
+        filepath = self.config.file_directory+'/'+filename
+        try:
+            header = fits.getheader(filepath, 1)
+            airmass = u.Quantity(header['AIRMASS']).to(u.dimensionless_unscaled).value
+            water_vapor = u.Quantity(header['VAPOR']).to(u.mm).value
+        except Exception:
+            raise ValueError(f'ERROR: In atmosphere_config.yaml -- File {filename} matching {kind}_filepath does not have a valid FITS header, check AIRMASS and VAPOR metadata')
+        checksum = 0
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                checksum = crc32(chunk, checksum)
+        return {'kind': kind, 'airmass': float(airmass), 'water_vapor': float(water_vapor), 'checksum': f'{checksum:08x}'}
+
+
+    def _write_manifest(self, manifest):
+        # Write to a temporary file first, then rename, so other processes never read a partially written manifest
+        filepath = self.config.cache_directory+'/manifest.json'
+        try:
+            makedirs(self.config.cache_directory, exist_ok=True)
+            with open(f'{filepath}.{getpid()}.tmp', 'w') as file:
+                json.dump(manifest, file, indent=2)
+            replace(f'{filepath}.{getpid()}.tmp', filepath)
+        except OSError as e:
+            warn(f'In atmosphere._write_manifest() -- unable to write manifest to {self.config.cache_directory}, headers will be read again next time\n{e}', RuntimeWarning)
+
+
+    def _manifest_checksum(self):
+        # Single checksum of the files used, and the grid cells they fill, for checking the compiled cache against
+        return f'{crc32(json.dumps([[x, y["kind"], y["airmass"], y["water_vapor"], y["checksum"]] for x, y in self._manifest.items()]).encode()):08x}'
+
+
+    def _read_cache(self):
+        # Memory-map cached arrays, so that pages are read on demand and shared between processes
+        try:
+            index = load(self.config.cache_directory+'/index.npz')
+            transmission = load(self.config.cache_directory+'/transmission.npy', mmap_mode='r')
+            emission = load(self.config.cache_directory+'/emission.npy', mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        # Only use cache if its indices and storage match the current config, and it was built from the files in the current manifest
+        if not (transmission.dtype == dtype(self.config.storage_dtype) and emission.dtype == dtype(self.config.storage_dtype) and
+                'manifest' in index.files and index['manifest'].item() == self._manifest_checksum() and
+                array_equal(index['airmass'], self._airmass_index.value) and
+                array_equal(index['water_vapor'], self._water_vapor_index.to(u.mm).value) and
+                array_equal(index['wavelength'], self._wavelength_index.to(u.angstrom).value)):
+            return False
+        self._transmission = transmission
+        self._emission = emission
+        return True
+
+
+    def _write_cache(self):
+        # Write to temporary files first, then rename, so other processes never read a partially written cache
+        try:
+            makedirs(self.config.cache_directory, exist_ok=True)
+            for name, data in [('transmission.npy', self._transmission), ('emission.npy', self._emission)]:
+                with open(f'{self.config.cache_directory}/{name}.{getpid()}.tmp', 'wb') as file:
+                    save(file, data)
+                replace(f'{self.config.cache_directory}/{name}.{getpid()}.tmp', self.config.cache_directory+'/'+name)
+            # Index is written last, marking the cache as complete
+            with open(f'{self.config.cache_directory}/index.npz.{getpid()}.tmp', 'wb') as file:
+                savez(file, airmass=self._airmass_index.value, water_vapor=self._water_vapor_index.to(u.mm).value, wavelength=self._wavelength_index.to(u.angstrom).value, manifest=self._manifest_checksum())
+            replace(f'{self.config.cache_directory}/index.npz.{getpid()}.tmp', self.config.cache_directory+'/index.npz')
+        except OSError as e:
+            warn(f'In atmosphere._write_cache() -- unable to write cache to {self.config.cache_directory}, using files directly\n{e}', RuntimeWarning)
+            return
+        # Switch to memory-mapped arrays so this process shares pages w/ others
+        self._read_cache()
+
+
+    def _get_window(self, wavelengths):
+        # Current window, or the full index if wavelengths fall outside of it, so that results are the same as w/o windows
+        start, stop = self._window
+        if wavelengths.size == 0:
+            return self._window
+        if (start > 0 and wavelengths.min() < self._wavelength_index.value[start]) or (stop < len(self._wavelength_index) and wavelengths.max() > self._wavelength_index.value[stop-1]):
+            return (0, len(self._wavelength_index))
+        return self._window
+
+
+    def _get_interpolator(self, name, window):
+        # Slices of memory-mapped arrays are views, so only pages in the window are read from the cache
+        key = (name,) + window
+        if key not in self._interpolators.keys():
+            grid = (self._airmass_index.value, self._water_vapor_index.to(u.mm).value)
+            data = self._transmission if name == 'transmission' else self._emission
+            self._interpolators[key] = RegularGridInterpolator(grid, data[:, :, window[0]:window[1]])
+        return self._interpolators[key]
+
+
+    def _get_spectrum(self, name, window):
+        key = (name, self.airmass.to(u.dimensionless_unscaled).value, self.water_vapor.to(u.mm).value) + window
+        spectrum = self._spectra.get(key)
+        if spectrum is None:
+            # Bilinear interpolation in airmass and water vapor, combined w/ linear interpolation in wavelength this is trilinear
+            spectrum = self._get_interpolator(name, window)([key[1:3]])[0]
+            self._spectra.put(key, spectrum, spectrum.nbytes)
+        return spectrum
 
 
     def _validate_config(self):
         # Throw errors if config file doesn't conform to requirements
 
 
-        # Check that all required fields exist and are spelled correctly
-        try:
-            _ = u.Quantity(self.config.defaults.seeing)
-            _ = u.Quantity(self.config.defaults.airmass)
-            _ = u.Quantity(self.config.defaults.water_vapor)
-            _ = self.config.file_directory
-            _ = self.config.emission_filepath
-            _ = self.config.transmission_filepath
-            _ = self.config.airmass_index
-            _ = self.config.water_vapor_index
-            _ = self.config.wavelength_index
-        except:
-            raise ValueError('ERROR: In atmosphere_config.yaml -- invalid configuration file, missing required value')
+        # Required values and their units are already checked against _CONFIG_SCHEMA when loaded
 
         # Check defaults.water_vapor and water_vapor_index
-        test_wvi = [u.Quantity(x) for x in self.config.water_vapor_index]
-        if not test_wvi == sorted(test_wvi):
+        test_wvi = self.config.water_vapor_index
+        if not (test_wvi[1:] > test_wvi[:-1]).all():
             raise ValueError('ERROR: In atmosphere_config.yaml -- water_vapor_index is not in ascending order')
-        if not test_wvi[0] <= u.Quantity(self.config.defaults.water_vapor) <= test_wvi[-1]:
+        if not test_wvi[0] <= self.config.defaults.water_vapor <= test_wvi[-1]:
             raise ValueError('ERROR: In atmosphere_config.yaml -- default water vapor is outside bounds of water_vapor_index')
         
         # Check defaults.airmass and airmass_index
-        test_ami = [u.Quantity(x) for x in self.config.airmass_index]
-        if not test_ami == sorted(test_ami):
+        test_ami = self.config.airmass_index
+        if not (test_ami[1:] > test_ami[:-1]).all():
             raise ValueError('ERROR: In atmosphere_config.yaml -- airmass_index is not in ascending order')
-        if not test_ami[0] <= u.Quantity(self.config.defaults.airmass) <= test_ami[-1]:
+        if not test_ami[0] <= self.config.defaults.airmass <= test_ami[-1]:
             raise ValueError('ERROR: In atmosphere_config.yaml -- default airmass is outside bounds of airmass_index')
 
         # Check wavelength_index
-        test_wi = [u.Quantity(x) for x in self.config.wavelength_index]
+        test_wi = self.config.wavelength_index
         if len(test_wi) != 3:
             raise ValueError('ERROR: In atmosphere_config.yaml -- wavelength_index does not have length == 3')
-        if not (all([x > 0*u.nm for x in test_wi]) and test_wi[2] < (test_wi[1] - test_wi[0])):
+        if not ((test_wi > 0*u.nm).all() and test_wi[2] < (test_wi[1] - test_wi[0])):
             raise ValueError('ERROR: In atmosphere_config.yaml -- wavelength_index does not match format (start, end, step)')
 
-        # Check emission_filepath and emission files
-        test_em = [x for x in listdir(self.config.file_directory) if x.startswith(self.config.emission_filepath)]
-        if not test_em:
-            raise ValueError('ERROR: In atmosphere_config.yaml -- file_directory or emission_filepath is invalid, no matching files')
-        try:
-            pass  # Fix validation later -- too slow!
-            # if not all([u.Quantity(Table.read(self.config.file_directory+'/'+x, format='ascii.ecsv', data_end=10).meta['water_vapor']) in test_wvi for x in test_em]):
-            #     raise ValueError('ERROR: In atmosphere_config.yaml -- File matching emission_filepath has water_vapor that does not match water_vapor_index')
-            # if not all([u.Quantity(Table.read(self.config.file_directory+'/'+x, format='ascii.ecsv', data_end=10).meta['airmass']) in test_ami for x in test_em]):
-            #     raise ValueError('ERROR: In atmosphere_config.yaml -- File matching emission_filepath has airmass that does not match airmass_index')
-        except:
-            raise ValueError('ERROR: In atmosphere_config.yaml -- File matching emission_filepath does not have a valid ECSV file header, check metadata')
-
-        # Check transmission_filepath and transmission files
-        test_tr = [x for x in listdir(self.config.file_directory) if x.startswith(self.config.transmission_filepath)]
-        if not test_tr:
-            raise ValueError('ERROR: In atmosphere_config.yaml -- file_directory or transmission_filepath is invalid, no matching files')
-        try:
-            pass  # Fix validation later -- too slow!
-            # if not all([u.Quantity(Table.read(self.config.file_directory+'/'+x, format='ascii.ecsv', data_end=10).meta['water_vapor']) in test_wvi for x in test_tr]):
-            #     raise ValueError('ERROR: In atmosphere_config.yaml -- File matching transmission_filepath has water_vapor that does not match water_vapor_index')
-            # if not all([u.Quantity(Table.read(self.config.file_directory+'/'+x, format='ascii.ecsv', data_end=10).meta['airmass']) in test_ami for x in test_tr]):
-            #     raise ValueError('ERROR: In atmosphere_config.yaml -- File matching transmission_filepath has airmass that does not match airmass_index')
-        except:
-            raise ValueError('ERROR: In atmosphere_config.yaml -- File matching transmission_filepath does not have a valid ECSV file header, check metadata')
+        # Check storage_dtype
+        if self.config.storage_dtype not in ['float32', 'float64']:
+            raise ValueError('ERROR: In atmosphere_config.yaml -- storage_dtype must be either float32 or float64')
+
+        # Check spectrum_cache_size
+        if self.config.spectrum_cache_size < 1:
+            raise ValueError('ERROR: In atmosphere_config.yaml -- spectrum_cache_size must be at least 1')
+
+
+    def _validate_files(self):
+        # Throw errors if atmosphere files don't fill the (airmass, water vapor) grid exactly once each, checked against the manifest
+
+        airmass_index = self.config.airmass_index.to(u.dimensionless_unscaled).value
+        water_vapor_index = self.config.water_vapor_index.to(u.mm).value
+        for kind in ['emission', 'transmission']:
+            files = {x: y for x, y in self._manifest.items() if y['kind'] == kind}
+            if not files:
+                raise ValueError(f'ERROR: In atmosphere_config.yaml -- file_directory or {kind}_filepath is invalid, no matching files')
+            cells = {}
+            for filename, entry in files.items():
+                if not isclose(water_vapor_index, entry['water_vapor']).any():
+                    raise ValueError(f'ERROR: In atmosphere_config.yaml -- File {filename} matching {kind}_filepath has water_vapor that does not match water_vapor_index')
+                if not isclose(airmass_index, entry['airmass']).any():
+                    raise ValueError(f'ERROR: In atmosphere_config.yaml -- File {filename} matching {kind}_filepath has airmass that does not match airmass_index')
+                cell = self._grid_cell(entry)
+                if cell in cells.keys():
+                    raise ValueError(f'ERROR: In atmosphere_config.yaml -- Files {cells[cell]} and {filename} matching {kind}_filepath have the same airmass and water_vapor')
+                cells[cell] = filename
+            missing = [(airmass_index[i], water_vapor_index[j]) for i in range(len(airmass_index)) for j in range(len(water_vapor_index)) if (i, j) not in cells.keys()]
+            if missing:
+                raise ValueError(f'ERROR: In atmosphere_config.yaml -- No file matching {kind}_filepath for (airmass, water_vapor) ' + ', '.join(f'({x:g}, {y:g} mm)' for x, y in missing))
 
-        
 
     def reset_parameters(self):
         
-        self.seeing = u.Quantity(self.config.defaults.seeing)
+        self.seeing = self.config.defaults.seeing
 
-        self.airmass = u.Quantity(self.config.defaults.airmass)
+        self.airmass = self.config.defaults.airmass
 
-        self.water_vapor = u.Quantity(self.config.defaults.water_vapor)
+        self.water_vapor = self.config.defaults.water_vapor
 
 
     def __init__(self):
@@ -158,41 +299,52 @@ class atmosphere:
 
         self._validate_config()
 
+        self._manifest = self._read_manifest()
+
+        self._validate_files()
+
         self.reset_parameters()
 
         self._load_files()
 
 
-    def get_transmission(self, wavelengths):
+    def set_window(self, min_wavelength, max_wavelength):
+        # Limit spectra to the part of self._wavelength_index covering [min_wavelength, max_wavelength], i.e. an instrument's range
+        # Includes the index values on either side, so that interpolating within the window is the same as w/ the full index
+        if not self.config.windowed:
+            return
+        index = self._wavelength_index.value
+        start = max(int(searchsorted(index, min_wavelength.to(u.angstrom).value, side='right')) - 1, 0)
+        stop = min(int(searchsorted(index, max_wavelength.to(u.angstrom).value, side='left')) + 1, len(index))
+        self._window = (start, stop)
+
 
-        results = zeros(len(wavelengths))
+    def memory_report(self):
+        # Bytes used by atmosphere data in this process, w/ the arrays in the cache counted in full even though they're memory-mapped
+        windows = {f'{self._wavelength_index[start].to(u.um):.4f} - {self._wavelength_index[stop-1].to(u.um):.4f}': self._transmission[:, :, start:stop].nbytes + self._emission[:, :, start:stop].nbytes
+                   for start, stop in sorted(set(key[1:] for key in self._interpolators.keys()))}
+        return {
+            'storage_dtype': self.config.storage_dtype,
+            'memory_mapped': isinstance(self._transmission, memmap),
+            'data_bytes': self._transmission.nbytes + self._emission.nbytes,
+            'window_bytes': windows,
+            'spectrum_cache_bytes': self._spectra.bytes
+        }
 
-        # Check for and remove out-of-bounds wavelengths to avoid RegularGridInterpolator throwing errors
-        wavelengths_trim = wavelengths[(self._wavelength_index[0] <= wavelengths) & (wavelengths <= self._wavelength_index[-1])]
-        # If results are outside the wavelength bounds, return 0
-        results[(self._wavelength_index[0] > wavelengths) | (wavelengths > self._wavelength_index[-1])] = 0
 
-        # Perform trilinear interpolation to find transmission values
-        interpolation = RegularGridInterpolator( (self._airmass_index, self._water_vapor_index, self._wavelength_index), self._transmission )
-        interpolation = interpolation([[self.airmass.value, self.water_vapor.to(u.mm).value, λ] for λ in wavelengths_trim.to(u.angstrom).value])
-        # Save interpolation values to results
-        results[(self._wavelength_index[0] <= wavelengths) & (wavelengths <= self._wavelength_index[-1])] = interpolation
+    def get_transmission(self, wavelengths):
+        # Interpolate cached spectrum at wavelengths, returning 0 for wavelengths outside the bounds of self._wavelength_index
+        wavelengths = wavelengths.to(u.angstrom).value
+        start, stop = window = self._get_window(wavelengths)
+        results = interp(wavelengths, self._wavelength_index.value[start:stop], self._get_spectrum('transmission', window), left=0, right=0)
         return results * u.Unit('')
 
 
     def get_emission(self, wavelengths):
-        results = zeros(len(wavelengths))
-
-        # Check for and remove out-of-bounds wavelengths to avoid RegularGridInterpolator throwing errors
-        wavelengths_trim = wavelengths[(self._wavelength_index[0] <= wavelengths) & (wavelengths <= self._wavelength_index[-1])]
-        # If results are outside the wavelength bounds, return 0
-        results[(self._wavelength_index[0] > wavelengths) | (wavelengths > self._wavelength_index[-1])] = 0
-
-        # Perform trilinear interpolation to find emission values
-        interpolation = RegularGridInterpolator( (self._airmass_index, self._water_vapor_index, self._wavelength_index), self._emission )
-        interpolation = interpolation([[self.airmass.value, self.water_vapor.to(u.mm).value, λ] for λ in wavelengths_trim.to(u.angstrom).value])
-        # Save interpolation values to results
-        results[(self._wavelength_index[0] <= wavelengths) & (wavelengths <= self._wavelength_index[-1])] = interpolation
+        # Interpolate cached spectrum at wavelengths, returning 0 for wavelengths outside the bounds of self._wavelength_index
+        wavelengths = wavelengths.to(u.angstrom).value
+        start, stop = window = self._get_window(wavelengths)
+        results = interp(wavelengths, self._wavelength_index.value[start:stop], self._get_spectrum('emission', window), left=0, right=0)
         return results * u.Unit('photon/(s arcsec^2 nm m^2)')
 
     
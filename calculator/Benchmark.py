@@ -0,0 +1,168 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+# Benchmarks for the calculator's hot paths, run from the base directory w/ python3 calculator/Benchmark.py
+# Results are saved as JSON, use --compare to check them against results saved from another commit
+# Use --root to benchmark another checkout, i.e. an older commit that doesn't have this script
+
+from argparse import ArgumentParser
+from time import perf_counter
+from statistics import median, mean
+from datetime import datetime
+from os import listdir, chdir
+from os.path import isdir, abspath
+from subprocess import Popen, PIPE, DEVNULL, run
+from urllib.request import urlopen
+from socket import socket
+from platform import python_version
+from sys import executable, path
+import json
+import warnings
+
+import numpy
+import astropy
+from astropy import units as u
+from numpy import linspace, geomspace
+
+
+def time_call(function, repeats):
+    # Time each call separately, so that the minimum isn't skewed by occasional slow calls
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return {'repeats': repeats, 'min': min(times), 'median': median(times), 'mean': mean(times)}
+
+
+def fork(calculator):
+    # Calculators from before fork() was added are reused instead, which is equivalent since each benchmark sets the parameters it uses
+    return calculator.fork() if hasattr(calculator, 'fork') else calculator
+
+
+def calculate(etc, parameters):
+    # Calculators from before calculate() was added are set up w/ set_parameters() instead
+    if hasattr(etc, 'calculate'):
+        return etc.calculate(parameters)
+    etc.set_parameters(parameters)
+    return etc
+
+
+def benchmark_construction(results, exposure_time_calculator, repeats):
+    results.append({'name': 'exposure_time_calculator()', **time_call(exposure_time_calculator, repeats)})
+
+
+def benchmark_instrument(results, etc, name, wavelengths_number, rows_number, repeats):
+    # Time each hot path for one instrument, w/ wavelengths_number wavelengths and rows_number exposures or S/N values
+    calculator = calculate(etc, {'instrument': name})
+    calculator.wavelengths = linspace(calculator.instrument.min_wavelength, calculator.instrument.max_wavelength, wavelengths_number).to(u.angstrom)
+    exposure = [f'{x}s' for x in geomspace(1, 36000, rows_number)]
+    signal_noise_ratio = [str(x) for x in geomspace(1, 1000, rows_number)]
+    case = {'instrument': name, 'wavelengths': wavelengths_number, 'rows': rows_number}
+
+    def add(name, function):
+        results.append({'name': name, **case, **time_call(function, repeats)})
+
+    add('set_parameters(exposure)', lambda: fork(calculator).set_parameters({'exposure': exposure}))
+    add('set_parameters(signal_noise_ratio)', lambda: fork(calculator).set_parameters({'signal_noise_ratio': signal_noise_ratio}))
+    for target, parameters in [('signal_noise_ratio', {'exposure': exposure}), ('exposure', {'signal_noise_ratio': signal_noise_ratio})]:
+        forked = fork(calculator)
+        forked.set_parameters(parameters)
+        add(f'_calculate(target={target})', forked._calculate)
+    add('get_parameters()', calculator.get_parameters)
+    for source_type in calculator.source.available_types:
+        forked = fork(calculator)
+        forked.set_parameter('source.type', source_type, run_calculator=False)
+        add(f'source.get_flux(type={source_type})', lambda: forked.source.get_flux(forked.wavelengths))
+    add('atmosphere.get_transmission()', lambda: calculator.atmosphere.get_transmission(calculator.wavelengths))
+    add('atmosphere.get_emission()', lambda: calculator.atmosphere.get_emission(calculator.wavelengths))
+
+
+def benchmark_http(results, instruments, repeats):
+    # Time full requests to a server started locally on a free port
+    with socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    server = Popen([executable, '-u', '-W', 'ignore', 'calculator/API.py', str(port)], stdout=PIPE, stderr=DEVNULL, text=True)
+    try:
+        for line in server.stdout:
+            if 'Server started' in line:
+                break
+        else:
+            raise RuntimeError('In Benchmark.benchmark_http() -- server exited before starting')
+        for name in instruments:
+            # Vary the exposure on each request, so that responses aren't served from the result cache
+            counter = iter(range(1, repeats+1))
+            url = lambda: f'http://localhost:{port}/api/etc?return=[signal_noise_ratio,wavelengths]&instrument={name}&exposure=[{next(counter)}s]'
+            results.append({'name': 'HTTP GET', 'instrument': name, **time_call(lambda: urlopen(url()).read(), repeats)})
+            results.append({'name': 'HTTP GET (cached)', 'instrument': name, **time_call(lambda: urlopen(f'http://localhost:{port}/api/etc?return=[signal_noise_ratio,wavelengths]&instrument={name}&exposure=[1s]').read(), repeats)})
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results, filepath):
+    # Print the ratio of median times for each benchmark in both sets of results
+    with open(filepath) as file:
+        previous = {key(result): result for result in json.load(file)['results']}
+    print(f'{"benchmark":<80} {"before":>10} {"after":>10} {"ratio":>7}')
+    for result in results:
+        if key(result) in previous.keys():
+            before = previous[key(result)]['median']
+            print(f'{" ".join(str(x) for x in key(result) if x is not None):<80} {before*1e3:>8.3f}ms {result["median"]*1e3:>8.3f}ms {result["median"]/before:>7.2f}')
+
+
+def key(result):
+    return (result['name'], result.get('instrument'), result.get('wavelengths'), result.get('rows'))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the exposure time calculator')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='path to save results, defaults to benchmark.json')
+    parser.add_argument('-r', '--repeats', type=int, default=20, help='number of times to repeat each benchmark, defaults to 20')
+    parser.add_argument('-w', '--wavelengths', type=int, nargs='+', default=[100, 1000, 10000], help='numbers of wavelengths to benchmark, defaults to 100 1000 10000')
+    parser.add_argument('-n', '--rows', type=int, nargs='+', default=[1, 100], help='numbers of exposures or S/N values to benchmark, defaults to 1 100')
+    parser.add_argument('-c', '--compare', help='path to results from a previous run to compare against')
+    parser.add_argument('--no-http', action='store_true', help='skip benchmarks of requests to a local API server')
+    parser.add_argument('--root', default='.', help='base directory of the checkout to benchmark, defaults to the current directory')
+    args = parser.parse_args()
+
+    # Benchmark the calculator in args.root, w/ paths relative to it as the calculator expects
+    output_filepath = abspath(args.output)
+    previous = abspath(args.compare) if args.compare is not None else None
+    chdir(args.root)
+    path.insert(0, abspath('calculator'))
+    from ETC import exposure_time_calculator
+
+    warnings.simplefilter('ignore')  # NaN results outside instrument bounds are expected
+    instruments = sorted(x for x in listdir('calculator/instruments') if isdir('calculator/instruments/'+x))
+    commit = run(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=DEVNULL, text=True).stdout.strip() or None
+
+    results = []
+    benchmark_construction(results, exposure_time_calculator, max(args.repeats // 10, 1))
+    etc = exposure_time_calculator()
+    for name in instruments:
+        for wavelengths_number in args.wavelengths:
+            for rows_number in args.rows:
+                print(f'Benchmarking {name} w/ {wavelengths_number} wavelengths and {rows_number} rows')
+                benchmark_instrument(results, etc, name, wavelengths_number, rows_number, args.repeats)
+    if not args.no_http:
+        print('Benchmarking HTTP requests')
+        benchmark_http(results, instruments, args.repeats)
+
+    output = {
+        'commit': commit,
+        'date': datetime.now().isoformat(),
+        'versions': {'python': python_version(), 'numpy': numpy.__version__, 'astropy': astropy.__version__},
+        'results': results
+    }
+    with open(output_filepath, 'w') as file:
+        json.dump(output, file, indent=2)
+    print(f'Saved {len(results)} results to {output_filepath}')
+
+    if previous is not None:
+        compare(results, previous)
@@ -0,0 +1,50 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+from collections import OrderedDict
+
+
+class bounded_cache:
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # No limit if None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)  # Mark as most recently used
+        return self._entries[key]
+
+    def put(self, key, value, size=0):
+        # Size in bytes is given by the caller, and only counts toward max_bytes
+        self.bytes += size - self._sizes.get(key, 0)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._entries.move_to_end(key)
+        # Evict least recently used entries until within bounds
+        while len(self._entries) > max(self.max_entries, 0) or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 0):
+            evicted, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.bytes = 0
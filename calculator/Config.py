@@ -0,0 +1,167 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+# Read-only configuration loaded from yaml files, checked against a schema once when loaded
+# Quantities are parsed up front, so that config values are used as is instead of parsed again w/ u.Quantity()
+#
+# A schema is a dict of {name: type}, where each type is one of
+#   str, bool, int, float                         plain values
+#   quantity(unit), quantities(unit)              a quantity, or a list of quantities as one array converted to unit
+#   [type]                                        a list of values of type, stored as a tuple
+#   {name: type}                                  a nested schema, w/ '*' matching any names not listed
+#   optional(type)                                a value that may be missing or null, left out of its node if null
+
+import yaml
+from os.path import normpath
+from astropy import units as u
+
+
+class quantity:
+
+    def __init__(self, unit=None):
+        self.unit = None if unit is None else u.Unit(unit)  # Any unit if None, otherwise units must be equivalent
+
+    def parse(self, value, path):
+        try:
+            value = u.Quantity(value)
+        except Exception:
+            raise _SchemaError(f'{path} is not a valid astropy quantity')
+        if self.unit is not None and not value.unit.is_equivalent(self.unit):
+            raise _SchemaError(f'{path} must have units equivalent to {self.unit}')
+        return value
+
+
+class quantities(quantity):
+
+    def parse(self, value, path):
+        if not isinstance(value, list):
+            raise _SchemaError(f'{path} must be a list')
+        # Parsed one at a time, then converted to a single unit, w/ nested lists for rows, i.e. [width, length] slits
+        value = [self.parse(x, f'{path}[{i}]') if isinstance(x, list) else super(quantities, self).parse(x, f'{path}[{i}]') for i, x in enumerate(value)]
+        return u.Quantity(value, self.unit)
+
+
+class optional:
+
+    def __init__(self, schema):
+        self.schema = schema
+
+
+class node:
+
+    # Immutable group of config values, read as attributes (config.defaults.seeing) or by name (config[mode])
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        for value in values.values():
+            _freeze(value)
+        object.__setattr__(self, '_values', dict(values))
+
+    def __getattr__(self, name):
+        if name == '_values':
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f'In Config -- missing config value {name}')
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'In Config -- config values are read-only, unable to set {name}')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'In Config -- config values are read-only, unable to delete {name}')
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __reduce__(self):
+        return (node, (self._values,))
+
+    def __repr__(self):
+        return f'node({self._values!r})'
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def values(self):
+        return self._values.values()
+
+    def items(self):
+        return self._values.items()
+
+
+class _SchemaError(ValueError):
+    pass
+
+
+def _freeze(value):
+    # Quantities are arrays, so they're made read-only to keep config values from being changed in place
+    if isinstance(value, u.Quantity):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for x in value:
+            _freeze(x)
+
+
+def _compile(value, schema, path):
+    if isinstance(schema, optional):
+        return None if value is None else _compile(value, schema.schema, path)
+    if value is None:
+        raise _SchemaError(f'missing required value {path or "(file is empty)"}')
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise _SchemaError(f'{path} must contain named values')
+        values = {}
+        for name, val in value.items():
+            if name not in schema.keys() and '*' not in schema.keys():
+                raise _SchemaError(f'unknown value {_join(path, name)}')
+            val = _compile(val, schema.get(name, schema.get('*')), _join(path, name))
+            # Optional values that are null are left out, as if they were missing
+            if val is not None:
+                values[name] = val
+        for name, val in schema.items():
+            if name != '*' and name not in values.keys() and not isinstance(val, optional):
+                raise _SchemaError(f'missing required value {_join(path, name)}')
+        return node(values)
+    if isinstance(schema, list):
+        if not isinstance(value, list):
+            raise _SchemaError(f'{path} must be a list')
+        return tuple(_compile(x, schema[0], f'{path}[{i}]') for i, x in enumerate(value))
+    if isinstance(schema, quantity):
+        return schema.parse(value, path)
+    # YAML booleans are also ints, so they're checked separately
+    if schema is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, schema) and (schema is bool or not isinstance(value, bool)):
+        return value
+    raise _SchemaError(f'{path} must be of type {schema.__name__}')
+
+
+def _join(path, name):
+    return name if len(path) == 0 else f'{path}.{name}'
+
+
+def load(filepath, schema):
+    # Read a yaml file and check it against schema, returning its values as a node
+    with open(filepath) as file:
+        data = yaml.safe_load(file)
+    try:
+        return _compile(data, schema, '')
+    except _SchemaError as e:
+        raise ValueError(f'ERROR: In {normpath(filepath)} -- {e}')
@@ -1,44 +1,220 @@
 from astropy import units as u
-from Instrument import instrument
+from Instrument import instrument, preload_instruments
 from Source import source
 from Atmosphere import atmosphere
-import yaml
-from numpy import pi, linspace, zeros, array, arccos, sqrt, NaN
+from Cache import bounded_cache
+import Config
+from Config import quantity, quantities
+from numpy import pi, linspace, zeros, ones, array, arccos, sqrt, NaN, newaxis, where, isnan
+import Engine
+import Snapshot
+import Metrics
 from warnings import warn
-from json import loads as json_loads
+from json import loads as json_loads, dumps as json_dumps
+from copy import copy
+from hashlib import sha1
+from os.path import isdir
+from itertools import product
+
+# Canonical units used by Engine, results are converted from these when units are attached
+_PHOTLAM = u.photon / (u.cm**2 * u.s * u.angstrom)
+_EMISSION = u.photon / (u.cm**2 * u.s * u.angstrom * u.arcsec**2)
+_COUNT_ADU = u.adu / u.pixel
+# Results w/ one row per exposure or signal to noise ratio
+_ROW_RESULTS = ['exposure', 'signal_noise_ratio', 'integration_time', 'source_count_adu', 'background_count_adu', 'dark_current_count_adu', 'read_noise_count_adu', 'total_count_adu', 'clock_time', 'efficiency']
+# Parameters that don't change spectra, throughput, or atmosphere transmission and emission, so ETC.calculate_batch() sets them separately for each parameter set
+_BATCH_SEPARATE_PARAMETERS = ['exposure', 'signal_noise_ratio', 'target', 'dithers', 'repeats', 'coadds', 'reads', 'slit', 'instrument.slit', 'binning', 'instrument.binning', 'seeing', 'atmosphere.seeing']
+# Parameters that can be swept over by ETC.sweep()
+_SWEEP_PARAMETERS = ['source.flux', 'atmosphere.seeing', 'atmosphere.airmass', 'atmosphere.water_vapor', 'exposure', 'signal_noise_ratio', 'dithers', 'repeats', 'coadds', 'reads']
+# Options, units, and names of parameters by (instrument, mode, class, parameter), which don't change once config files are loaded
+_PARAMETER_OPTIONS = {}
+
+# Values in config.yaml, see Config.py
+_CONFIG_SCHEMA = {
+    'instruments': [str],
+    'preload_instruments': bool,
+    'warm_start': bool,
+    'snapshot_filepath': str,
+    'defaults': {
+        'instrument': str,
+        'exposure': quantities(u.s),
+        'signal_noise_ratio': quantities(u.dimensionless_unscaled),
+        'target': str,
+        'default_wavelengths_number': int,
+        'dithers': quantity(u.dimensionless_unscaled),
+        'reads': quantity(u.dimensionless_unscaled),
+        'repeats': quantity(u.dimensionless_unscaled),
+        'coadds': quantity(u.dimensionless_unscaled)
+    },
+    'telescope_area': quantity(u.m**2),
+    'reference_mode': bool,
+    'system_response_cache_size': int,
+    'precompute_system_responses': bool,
+    'reads_options': [int],
+    'target_options': [str]
+}
+
+
+def _parse_list(value):
+    # Lists may also be given as strings, i.e. "[600s, 1200s]", the same as in API queries
+    if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
+        return [x.strip() for x in value[1:-1].split(',') if x.strip()]
+    return value
+
 
 class exposure_time_calculator:
 
     global _CONFIG_FILEPATH; _CONFIG_FILEPATH = './calculator/config.yaml'
 
     def _mount_config(self, config_path):
-        # From https://www.geeksforgeeks.org/convert-nested-python-dictionary-to-object/
-        def _dict2obj(d):
-            # If list, recursively unpack
-            if isinstance(d, list):
-                d = [_dict2obj(x) for x in d]
-            # If not list or dictionary, return object
-            if not isinstance(d, dict):
-                return d
-            # Otherwise, create dummy object
-            class Foo:
-                pass
-            obj = Foo()
-            # Loop over dictionary items and add to object
-            for x in d:
-                obj.__dict__[x] = _dict2obj(d[x])
-            return obj
-        # Open config file, convert & mount to self
-        config = yaml.safe_load(open(config_path))
-        config = _dict2obj(config)
-        self.__dict__.update({'config': config})
+        self.config = Config.load(config_path, _CONFIG_SCHEMA)
 
 
     def _validate_config(self):
-        pass  # TODO
+        # Throw errors if config values are inconsistent, values are already checked against _CONFIG_SCHEMA when loaded
+        if self.config.defaults.instrument not in self.config.instruments:
+            raise ValueError('ERROR: In config.yaml -- default instrument is not in instruments')
+        if self.config.defaults.target not in self.config.target_options:
+            raise ValueError('ERROR: In config.yaml -- default target is not in target_options')
+        if int(self.config.defaults.reads.value) not in self.config.reads_options:
+            raise ValueError('ERROR: In config.yaml -- default reads is not in reads_options')
+        if not all([self.config.defaults[name] >= 1 for name in ['dithers', 'repeats', 'coadds']]):
+            raise ValueError('ERROR: In config.yaml -- default dithers, repeats, and coadds must be at least 1')
+        if len(self.config.defaults.exposure) == 0 or len(self.config.defaults.signal_noise_ratio) == 0:
+            raise ValueError('ERROR: In config.yaml -- default exposure and signal_noise_ratio must not be empty')
+        if self.config.defaults.default_wavelengths_number < 2:
+            raise ValueError('ERROR: In config.yaml -- default_wavelengths_number must be at least 2')
+        if self.config.system_response_cache_size < 1:
+            raise ValueError('ERROR: In config.yaml -- system_response_cache_size must be at least 1')
 
 
     def _calculate(self):
+        with Metrics.stage('calculate'):
+            self._default_targets()
+
+            if self.reference_mode:
+                self._calculate_reference()
+            else:
+                self._calculate_fast()
+
+
+    def _default_targets(self):
+        if self.target == 'signal_noise_ratio' and len(self.exposure) == 0:
+            self.exposure = self.config.defaults.exposure
+            warn('In ETC -- exposure is not defined, defaulting to '+str(self.exposure), RuntimeWarning)
+        elif self.target == 'exposure' and len(self.signal_noise_ratio) == 0:
+            self.signal_noise_ratio = self.config.defaults.signal_noise_ratio
+            warn('In ETC -- signal_noise_ratio is not defined, defaulting to '+str(self.signal_noise_ratio), RuntimeWarning)
+
+
+    def _canonical_inputs(self, grid=None):
+        # Convert every input to canonical units once -- photon / (cm^2 s angstrom), arcsec, s, electron -- as float64 values
+        # grid optionally replaces seeing, source_flux, transmission, emission, number_exposures, and reads w/ arrays that broadcast against wavelength
+        grid = {} if grid is None else grid
+        wavelengths = self.wavelengths.to(u.angstrom).value
+        binning = self.instrument.binning.value
+        resolution_element = wavelengths / self.instrument.spectral_resolution.to(u.dimensionless_unscaled).value
+        slit_width = self.instrument.slit_width.to(u.arcsec).value
+        slit_size = slit_width * self.instrument.slit_length.to(u.arcsec).value
+        seeing = grid['seeing'] if 'seeing' in grid else self.atmosphere.seeing.to(u.arcsec).value
+        with Metrics.stage('calculate.source'):
+            source_flux = grid['source_flux'] if 'source_flux' in grid else self.source.get_flux(self.wavelengths).to(_PHOTLAM).value
+        if 'transmission' in grid:
+            with Metrics.stage('calculate.throughput'):
+                throughput = self.instrument.get_throughput(self.wavelengths).to(u.electron / u.photon).value
+            transmission, system_transmission, system_emission = grid['transmission'], grid['transmission'] * throughput, grid['emission'] * throughput
+        else:
+            with Metrics.stage('calculate.system_response'):
+                transmission, system_transmission, system_emission = self._system_response()
+        number_exposures = grid['number_exposures'] if 'number_exposures' in grid else (self.dithers * self.repeats * self.coadds).to(u.dimensionless_unscaled).value
+        reads = grid['reads'] if 'reads' in grid else self.reads.to(u.dimensionless_unscaled).value
+        telescope_area = self.telescope_area.to(u.cm**2).value
+        inputs = {
+            'pixel_size': self.instrument.pixel_size.to(u.arcsec**2 / u.pixel).value,
+            'gain': self.instrument.gain.to(u.electron / u.adu).value,
+            'slit_size': slit_size,
+            'source_size': Engine.source_size(seeing, slit_width),
+            'number_exposures': number_exposures,
+            'source_flux': source_flux * transmission
+        }
+        inputs['slit_size_pixels'] = slit_size / inputs['pixel_size']
+        # Rates in e- / s over the slit and resolution element, binning in the spectral direction
+        inputs['source_rate'] = source_flux * system_transmission * binning[0] * binning[1] * telescope_area * inputs['source_size'] / (pi * (seeing/2)**2) * resolution_element
+        inputs['background_rate'] = system_emission * binning[0] * binning[1] * telescope_area * slit_size * resolution_element
+        inputs['dark_current_rate'] = self.instrument.get_dark_current().to(u.electron / (u.pixel * u.s)).value * inputs['slit_size_pixels']
+        # Read noise in e-, binning in the spatial direction
+        inputs['read_noise'] = (self.instrument.get_read_noise()**2).to(u.electron / u.pixel).value * inputs['slit_size_pixels'] / sqrt(reads) / binning[0]
+        return inputs
+
+
+    def _system_response(self):
+        # Atmosphere transmission, and transmission and emission times instrument throughput, on self.wavelengths
+        # These don't depend on the source or exposure, so they're cached by instrument configuration, airmass, water vapor, and wavelengths
+        key = (
+            self.instrument.get_configuration(),
+            self.atmosphere.airmass.to(u.dimensionless_unscaled).value,
+            self.atmosphere.water_vapor.to(u.mm).value,
+            str(self.wavelengths.unit),
+            sha1(self.wavelengths.value.tobytes()).digest()
+        )
+        response = self._system_responses.get(key)
+        if response is None:
+            with Metrics.stage('calculate.throughput'):
+                throughput = self.instrument.get_throughput(self.wavelengths).to(u.electron / u.photon).value
+            with Metrics.stage('calculate.atmosphere'):
+                transmission = self.atmosphere.get_transmission(self.wavelengths).to(u.dimensionless_unscaled).value
+                emission = self.atmosphere.get_emission(self.wavelengths).to(_EMISSION).value
+            response = (transmission, transmission * throughput, emission * throughput)
+            # Shared w/ forked calculators, so made read-only
+            for curve in response:
+                curve.flags.writeable = False
+            self._system_responses.put(key, response, sum(curve.nbytes for curve in response))
+        return response
+
+
+    def _calculate_fast(self, inputs=None):
+        inputs = self._canonical_inputs() if inputs is None else inputs
+        number_exposures = inputs['number_exposures']
+
+        with Metrics.stage('calculate.engine'):
+            if self.target == 'signal_noise_ratio':
+                integration_time = self.exposure.to(u.s).value * number_exposures
+                # Shaped (exposures, 1) so that results broadcast to (exposures, wavelengths)
+                total_exposure = integration_time[:, newaxis]
+                snr = Engine.signal_noise_ratio(inputs['source_rate'], inputs['background_rate'], inputs['dark_current_rate'], inputs['read_noise'], total_exposure, number_exposures)
+                self.signal_noise_ratio = u.Quantity(snr, u.dimensionless_unscaled)
+
+            elif self.target == 'exposure':
+                snr = self.signal_noise_ratio.to(u.dimensionless_unscaled).value[:, newaxis]
+                integration_time = Engine.integration_time(inputs['source_rate'], inputs['background_rate'], inputs['dark_current_rate'], inputs['read_noise'], snr, number_exposures)
+                if isnan(integration_time).any():
+                    warn('In ETC -- Some/all solutions do not exist for S/N = '+str(self.signal_noise_ratio.value[isnan(integration_time).any(axis=1)].tolist())+', returning exposure = NaN', RuntimeWarning)
+                total_exposure = integration_time
+                # Get length of single exposure
+                self.exposure = u.Quantity(integration_time / number_exposures, u.s)
+
+            else:
+                # Check that etc has a valid target set
+                raise ValueError('ERROR: In ETC -- target must be set to "exposure" or "signal_noise_ratio"')
+
+            # Compute and save counts in ADU/pixel, w/ shape (exposures or signal_noise_ratio, wavelengths)
+            shape = (len(total_exposure), len(self.wavelengths))
+            self.source_flux = u.Quantity(inputs['source_flux'], _PHOTLAM)
+            self.integration_time = u.Quantity(integration_time, u.s)
+            self.source_count_adu = u.Quantity(inputs['source_rate'] * inputs['pixel_size'] / inputs['source_size'] * total_exposure / inputs['gain'], _COUNT_ADU)
+            self.background_count_adu = u.Quantity(inputs['background_rate'] / inputs['slit_size'] * inputs['pixel_size'] * total_exposure / inputs['gain'] * ones(shape), _COUNT_ADU)
+            self.dark_current_count_adu = u.Quantity(inputs['dark_current_rate'] / inputs['slit_size_pixels'] * total_exposure / inputs['gain'] * ones(shape), _COUNT_ADU)
+            self.read_noise_count_adu = u.Quantity(inputs['read_noise'] / inputs['slit_size_pixels'] * number_exposures / inputs['gain'] * ones(shape), _COUNT_ADU)
+
+            # Save total counts
+            self.total_count_adu = self.source_count_adu + self.background_count_adu + self.dark_current_count_adu + self.read_noise_count_adu
+            # Save clock time, efficiency
+            self.clock_time = self.integration_time * NaN
+            self.efficiency = self.integration_time / self.clock_time
+
+
+    def _calculate_reference(self):
+        # Reference implementation using astropy quantities throughout, slower but useful to check _calculate_fast()
 
         slit_size = self.instrument.slit_width * self.instrument.slit_length
         slit_size_pixels = slit_size / self.instrument.pixel_size
@@ -66,71 +242,57 @@ class exposure_time_calculator:
         
         if self.target == 'signal_noise_ratio':
 
-            if len(self.exposure) == 0:
-                self.exposure = [u.Quantity(x) for x in self.config.defaults.exposure] * u.s
-                warn('In ETC -- exposure is not defined, defaulting to '+str(self.exposure), RuntimeWarning)
+            # Total time for each exposure, shaped (exposures, 1) so that results broadcast to (exposures, wavelengths)
+            total_exposure = (self.exposure * number_exposures)[:, newaxis]
+            # Terms that are constant in wavelength are expanded to a full row, matching the shape of source and background
+            wavelength_ones = ones(len(self.wavelengths))
 
             # Compute and save counts in ADU/pixel
-            self.source_count_adu = [source_rate * self.instrument.pixel_size / source_size * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.background_count_adu = [background_rate / slit_size * self.instrument.pixel_size * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.dark_current_count_adu = [dark_current_rate / slit_size_pixels * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.read_noise_count_adu = ([read_noise / slit_size_pixels * number_exposures / self.instrument.gain] * len(self.exposure)) * (u.adu/u.pixel)
+            self.source_count_adu = (source_rate * self.instrument.pixel_size / source_size * total_exposure / self.instrument.gain).to(u.adu/u.pixel)
+            self.background_count_adu = (background_rate / slit_size * self.instrument.pixel_size * total_exposure / self.instrument.gain).to(u.adu/u.pixel)
+            self.dark_current_count_adu = (dark_current_rate / slit_size_pixels * total_exposure / self.instrument.gain * wavelength_ones).to(u.adu/u.pixel)
+            self.read_noise_count_adu = (read_noise / slit_size_pixels * number_exposures / self.instrument.gain * ones(self.source_count_adu.shape)).to(u.adu/u.pixel)
 
             # Save total integration time
-            self.integration_time = [(number_exposures * exp) for exp in self.exposure] * u.s
+            self.integration_time = (self.exposure * number_exposures).to(u.s)
 
             # Get counts in e- over entire slit during exposure
-            source_count_e = [source_rate * exp * number_exposures for exp in self.exposure] * u.electron
-            background_count_e = [background_rate * exp * number_exposures for exp in self.exposure] * u.electron
-            dark_current_count_e = [dark_current_rate * exp * number_exposures for exp in self.exposure] * u.electron
-            read_noise_count_e = ([read_noise * number_exposures] * len(self.exposure)) * u.electron
+            source_count_e = (source_rate * total_exposure).to(u.electron)
+            background_count_e = (background_rate * total_exposure).to(u.electron)
+            dark_current_count_e = (dark_current_rate * total_exposure * wavelength_ones).to(u.electron)
+            read_noise_count_e = (read_noise * number_exposures).to(u.electron)
             
             # Sum counts to get total noise
-            noise_count = [source_count_e[exp] + background_count_e[exp] + dark_current_count_e[exp] + read_noise_count_e[exp] for exp in range(len(self.exposure))]  # Total count in e- for whole slit and exposure
+            noise_count = source_count_e + background_count_e + dark_current_count_e + read_noise_count_e  # Total count in e- for whole slit and exposure
             
             # Signal to noise ratio = signal / sqrt(noise)
-            self.signal_noise_ratio = [(source_count_e[exp] * noise_count[exp] ** (-1/2)).value for exp in range(len(self.exposure))] * u.dimensionless_unscaled # Remove the sqrt(e-) unit because it's nonphysical
+            self.signal_noise_ratio = (source_count_e * noise_count ** (-1/2)).value * u.dimensionless_unscaled  # Remove the sqrt(e-) unit because it's nonphysical
 
         elif self.target == 'exposure':
 
-            if len(self.signal_noise_ratio) == 0:
-                self.signal_noise_ratio = [u.Quantity(x) for x in self.config.defaults.signal_noise_ratio] * u.dimensionless_unscaled
-                warn('In ETC -- signal_noise_ratio is not defined, defaulting to '+str(self.signal_noise_ratio), RuntimeWarning)
-
-            # Initialize exposure array for output
-            self.integration_time = zeros([len(self.signal_noise_ratio), len(self.wavelengths)])
-
-            for idx, snr in enumerate(self.signal_noise_ratio.value * u.electron**(1/2)):
-
-                # Define a, b, c for quadratic formula
-                # Adding 0j to avoid generating RuntimeWarning for sqrt(-1)
-                a = source_rate**2 + 0j
-                b = - snr**2 * (background_rate + dark_current_rate + source_rate) / number_exposures + 0j
-                c = [ (-read_noise * snr**2 / number_exposures).to(u.electron**2).value ] * len(self.wavelengths) * u.electron**2 + 0j
-
-
-                # Quadratic formula
-                exposure_pos = ( -b + (b**2 - 4*a*c)**(1/2) ) / (2 * a)
-                exposure_neg = ( -b - (b**2 - 4*a*c)**(1/2) ) / (2 * a)
-                
-                # This statement is broken, iter() needs to be moved outside because it reinitializes every time
-                iter_exp_pos = iter(exposure_pos)
-                iter_exp_neg = iter(exposure_neg)
-                exposure = [next(iter_exp_pos) if check else next(iter_exp_neg) for check in (exposure_pos.real >= 0) & (exposure_pos.imag == 0)] * u.s
-                if ((exposure.real < 0) | (exposure.imag != 0)).any():
-                    exposure[(exposure.real < 0) | (exposure.imag != 0)] = NaN
-                    warn('In ETC -- Some/all solutions do not exist for S/N = '+str(snr.value)+', returning exposure = NaN', RuntimeWarning)
-                self.integration_time[idx, :] = exposure.real.to(u.s)
-
-            self.integration_time = u.Quantity(self.integration_time, u.s)  # Convert ndarray to quantity
+            # Coefficients of a*t^2 + b*t + c = 0 for total integration time t, broadcast to (signal_noise_ratio, wavelengths)
+            snr_squared = (self.signal_noise_ratio.value[:, newaxis] ** 2) * u.electron
+            a = (source_rate**2).to(u.electron**2 / u.s**2).value
+            b = (- snr_squared * (background_rate + dark_current_rate + source_rate) / number_exposures).to(u.electron**2 / u.s).value
+            c = (- read_noise * snr_squared / number_exposures).to(u.electron**2).value
+
+            # Use the positive root where it exists, otherwise the negative root, and mark anything else as NaN
+            exposure_pos, exposure_neg = Engine.solve_quadratic(a, b, c)
+            exposure = where(exposure_pos >= 0, exposure_pos, exposure_neg)
+            invalid = ~(exposure >= 0)  # Also true for NaN
+            if invalid.any():
+                exposure[invalid] = NaN
+                warn('In ETC -- Some/all solutions do not exist for S/N = '+str(self.signal_noise_ratio.value[invalid.any(axis=1)].tolist())+', returning exposure = NaN', RuntimeWarning)
+
+            self.integration_time = u.Quantity(exposure, u.s)  # Convert ndarray to quantity
             # Get length of single exposure
-            self.exposure = [(t / number_exposures) for t in self.integration_time] * u.s
+            self.exposure = (self.integration_time / number_exposures).to(u.s)
 
             # Calculate and save counts based on calculated exposure = f(wavelength)
-            self.source_count_adu = [source_rate * self.instrument.pixel_size / source_size * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.background_count_adu = [background_rate / slit_size * self.instrument.pixel_size * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.dark_current_count_adu = [dark_current_rate / slit_size_pixels * exp * number_exposures / self.instrument.gain for exp in self.exposure] * (u.adu/u.pixel)
-            self.read_noise_count_adu = ([[(read_noise / slit_size_pixels * number_exposures / self.instrument.gain).to(u.adu/u.pixel).value] * len(self.wavelengths)] * len(self.exposure)) * (u.adu/u.pixel)
+            self.source_count_adu = (source_rate * self.instrument.pixel_size / source_size * self.integration_time / self.instrument.gain).to(u.adu/u.pixel)
+            self.background_count_adu = (background_rate / slit_size * self.instrument.pixel_size * self.integration_time / self.instrument.gain).to(u.adu/u.pixel)
+            self.dark_current_count_adu = (dark_current_rate / slit_size_pixels * self.integration_time / self.instrument.gain).to(u.adu/u.pixel)
+            self.read_noise_count_adu = (read_noise / slit_size_pixels * number_exposures / self.instrument.gain * ones(self.integration_time.shape)).to(u.adu/u.pixel)
 
         else:
             # Check that etc has a valid target set
@@ -146,19 +308,20 @@ class exposure_time_calculator:
     def reset_parameters(self):
 
         # Initialize values
-        self.telescope_area = u.Quantity(self.config.telescope_area)
-        self.exposure = [u.Quantity(x) for x in self.config.defaults.exposure] * u.s
-        self.signal_noise_ratio = [u.Quantity(x) for x in self.config.defaults.signal_noise_ratio] * u.dimensionless_unscaled
-        self.dithers = u.Quantity(self.config.defaults.dithers)
-        self.reads = u.Quantity(self.config.defaults.reads)
-        self.repeats = u.Quantity(self.config.defaults.repeats)
-        self.coadds = u.Quantity(self.config.defaults.coadds)
+        self.telescope_area = self.config.telescope_area
+        self.exposure = self.config.defaults.exposure
+        self.signal_noise_ratio = self.config.defaults.signal_noise_ratio
+        self.dithers = self.config.defaults.dithers
+        self.reads = self.config.defaults.reads
+        self.repeats = self.config.defaults.repeats
+        self.coadds = self.config.defaults.coadds
         self.target = self.config.defaults.target
 
         # Reset objects
         self.instrument.set_parameter('name', self.config.defaults.instrument)
         # Calculate default wavelengths array from min, max of instrument
         self.wavelengths = linspace(self.instrument.min_wavelength, self.instrument.max_wavelength, self.config.defaults.default_wavelengths_number).to(u.angstrom)
+        self.atmosphere.set_window(self.instrument.min_wavelength, self.instrument.max_wavelength)
 
         self.atmosphere.reset_parameters()
         self.source.reset_parameters()
@@ -168,19 +331,211 @@ class exposure_time_calculator:
         # Set default values based on config file
         self._mount_config(_CONFIG_FILEPATH)
         self._validate_config()
+        self.reference_mode = self.config.reference_mode
 
         # Initialize objects
+        if self.config.warm_start:
+            Snapshot.mount(self.config.snapshot_filepath)
+        if self.config.preload_instruments:
+            preload_instruments(self.config.instruments)
         self.instrument = instrument(self.config.defaults.instrument)
         self.atmosphere = atmosphere()
         self.source = source()
+        Snapshot.save()
         u.add_enabled_units([self.source.flam, self.source.photlam])
         u.imperial.enable()
 
+        # System responses by instrument configuration, atmosphere, and wavelengths, shared w/ forked calculators
+        self._system_responses = bounded_cache(self.config.system_response_cache_size)
+
         self.reset_parameters()
 
         self._calculate()
 
-    def set_parameters(self, parameters):
+        # Find system responses for the default configuration of each available instrument, on its default wavelengths
+        if self.config.precompute_system_responses:
+            for name in [x for x in self.config.instruments if isdir('calculator/instruments/'+x)]:
+                forked = self.fork()
+                forked.set_parameter('instrument.name', name, run_calculator=False)
+                forked._system_response()
+
+    def fork(self):
+        # Copy that shares loaded data (atmosphere, templates, throughput) w/ this calculator, but whose parameters are its own
+        # Setting a parameter replaces the attribute rather than modifying it, so shallow copies are enough
+        forked = copy(self)
+        forked.instrument = copy(self.instrument)
+        forked.atmosphere = copy(self.atmosphere)
+        forked.source = self.source.fork()
+        return forked
+
+    def calculate(self, parameters):
+        # Return a new calculator w/ results for the given parameters, leaving this calculator unchanged
+        forked = self.fork()
+        forked.set_parameters(dict(parameters) if isinstance(parameters, dict) else parameters)
+        return forked
+
+    def calculate_batch(self, parameter_sets):
+        # Return a list w/ either a new calculator or the exception raised for each parameter dict, leaving this calculator unchanged
+        # Parameter sets that share an instrument configuration, atmosphere, and source are set up once on the same fork, so shared spectra and throughput are found once
+        # Within each of these groups, sets that differ only in their exposure or signal_noise_ratio list are calculated together
+        def calculate(calculator, parameters):
+            try:
+                return calculator.calculate(parameters)
+            except Exception as e:
+                return e
+
+        groups = {}
+        for idx, parameters in enumerate(parameter_sets):
+            parameters = {key: _parse_list(val) if key in ['exposure', 'signal_noise_ratio', 'wavelengths'] else val for key, val in parameters.items()}
+            keys = list(parameters.keys())
+            # Setting an instrument parameter resets slit, binning, and wavelengths, so separate parameters can only be set last if none of these come before another parameter
+            reordered = any(key in _BATCH_SEPARATE_PARAMETERS and key.split('.')[-1] in ['slit', 'binning'] and any(x not in _BATCH_SEPARATE_PARAMETERS for x in keys[i+1:]) for i, key in enumerate(keys))
+            separate = {} if reordered else {key: val for key, val in parameters.items() if key in _BATCH_SEPARATE_PARAMETERS}
+            shared = {key: val for key, val in parameters.items() if key not in separate.keys()}
+            groups.setdefault(json_dumps(list(shared.items()), default=str), (shared, []))[1].append((idx, separate))
+
+        results = [None] * len(parameter_sets)
+        for shared, members in groups.values():
+            base = self.fork()
+            try:
+                base.set_parameters(dict(shared), run_calculator=False)
+            except Exception:
+                # Calculate each on its own, so that errors are reported for each parameter set in full
+                for idx, _ in members:
+                    results[idx] = calculate(self, parameter_sets[idx])
+                continue
+
+            rows_groups = {}
+            for idx, parameters in members:
+                rows = [key for key in ['exposure', 'signal_noise_ratio'] if key in parameters.keys()]
+                target = 'signal_noise_ratio' if rows == ['exposure'] else 'exposure' if rows == ['signal_noise_ratio'] else None
+                if target is not None and parameters.get('target', target) == target and isinstance(parameters[rows[0]], (str, list)) and len(parameters[rows[0]]) > 0:
+                    key = (rows[0], json_dumps({key: val for key, val in parameters.items() if key != rows[0]}, sort_keys=True, default=str))
+                else:
+                    key = (None, idx)  # Calculate on its own
+                rows_groups.setdefault(key, []).append((idx, parameters))
+
+            for (name, _), indices in rows_groups.items():
+                if name is None or len(indices) == 1:
+                    for idx, parameters in indices:
+                        results[idx] = calculate(base, parameters)
+                    continue
+                # Calculate all rows at once, then split them back up
+                rows = [[value] if isinstance(value, str) else value for value in [parameters[name] for _, parameters in indices]]
+                parameters = {key: val for key, val in indices[0][1].items() if key != name}
+                parameters[name] = [value for values in rows for value in values]
+                combined = calculate(base, parameters)
+                start = 0
+                for (idx, parameters), values in zip(indices, rows):
+                    if isinstance(combined, Exception):
+                        # Calculate separately so that one invalid parameter set doesn't cause errors for the rest
+                        results[idx] = calculate(base, parameters)
+                    else:
+                        results[idx] = combined._rows(start, start + len(values))
+                    start += len(values)
+        return results
+
+    def _rows(self, start, stop):
+        # Fork w/ only the given rows of results that were calculated for several exposures or signal to noise ratios at once
+        forked = self.fork()
+        for name in _ROW_RESULTS:
+            vars(forked)[name] = vars(self)[name][start:stop]
+        return forked
+
+    def calculate_rows(self):
+        # Generator of calculators w/ results for one exposure or signal to noise ratio each, calculated as they're used, leaving this calculator unchanged
+        # Inputs shared by every row are only calculated once
+        forked = self.fork()
+        forked._default_targets()
+        name = 'exposure' if forked.target == 'signal_noise_ratio' else 'signal_noise_ratio'
+        inputs = None if forked.reference_mode else forked._canonical_inputs()
+        for idx in range(len(vars(forked)[name])):
+            row = copy(forked)
+            vars(row)[name] = vars(forked)[name][idx:idx+1]
+            if inputs is None:
+                row._calculate()
+            else:
+                row._calculate_fast(inputs)
+            yield row
+
+    def sweep(self, axes):
+        # Return signal_noise_ratio or exposure on a dense grid, w/ a dimension for each axis in order, then one for wavelength, leaving this calculator unchanged
+        # axes is a dict of parameter name -> list of values, i.e. {'source.flux': ['20mag(AB)', '22mag(AB)'], 'exposure': ['600s', '1200s']}
+        # Other parameters are the current ones, so use calculate() first to sweep around different values, i.e. etc.calculate({'instrument.name': 'deimos'}).sweep(axes)
+        # If neither exposure nor signal_noise_ratio is an axis, the current values for the target are added as the last axis
+        swept = {}
+        for name, values in axes.items():
+            # Coerce parameter name, if applicable
+            if 'source.'+name in _SWEEP_PARAMETERS:
+                name = 'source.'+name
+            elif 'atmosphere.'+name in _SWEEP_PARAMETERS:
+                name = 'atmosphere.'+name
+            if name not in _SWEEP_PARAMETERS:
+                raise ValueError(f'In ETC.sweep() -- cannot sweep over parameter {name}, must be one of {", ".join(_SWEEP_PARAMETERS)}')
+            swept[name] = [values] if isinstance(values, str) else list(values)
+        if 'exposure' in swept.keys() and 'signal_noise_ratio' in swept.keys():
+            raise ValueError('In ETC.sweep() -- cannot sweep over both exposure and signal_noise_ratio')
+        if 'exposure' not in swept.keys() and 'signal_noise_ratio' not in swept.keys():
+            name = 'exposure' if self.target == 'signal_noise_ratio' else 'signal_noise_ratio'
+            swept[name] = list(vars(self)[name])
+        names = list(swept.keys())
+        shape = tuple(len(values) for values in swept.values()) + (len(self.wavelengths),)
+
+        def parameter(name, unit):
+            # Values of a swept ETC parameter shaped to broadcast along its axis, otherwise the current value
+            if name not in names:
+                return vars(self)[name].to(unit).value
+            values = array([u.Quantity(x).to(unit).value for x in swept[name]])
+            return values.reshape([-1 if axis == name else 1 for axis in names] + [1])
+
+        def evaluate(parameters, function):
+            # Evaluate function of a dict of parameter values, which returns an array over wavelength, for every combination of swept parameters
+            parameters = [name for name in names if name in parameters]
+            result = zeros([len(swept[name]) if name in parameters else 1 for name in names] + [len(self.wavelengths)])
+            for combination in product(*[list(enumerate(swept[name])) for name in parameters]):
+                index = [0] * len(names)
+                for name, (idx, _) in zip(parameters, combination):
+                    index[names.index(name)] = idx
+                result[tuple(index)] = function({name: value for name, (_, value) in zip(parameters, combination)})
+            return result
+
+        def source_flux(parameters):
+            forked = self.source.fork()
+            forked.set_parameter('flux', parameters['source.flux'])
+            return forked.get_flux(self.wavelengths).to(_PHOTLAM).value
+
+        def atmosphere(parameters):
+            forked = copy(self.atmosphere)
+            for name, value in parameters.items():
+                forked.set_parameter(name.replace('atmosphere.', ''), value)
+            return forked
+
+        # Spectra are found once for each value (or combination of airmass and water vapor), everything else is broadcast
+        grid = {
+            'number_exposures': parameter('dithers', u.dimensionless_unscaled) * parameter('repeats', u.dimensionless_unscaled) * parameter('coadds', u.dimensionless_unscaled),
+            'reads': parameter('reads', u.dimensionless_unscaled)
+        }
+        if 'atmosphere.seeing' in names:
+            for value in swept['atmosphere.seeing']:
+                copy(self.atmosphere).set_parameter('seeing', value)  # Validate
+            grid['seeing'] = array([u.Quantity(x).to(u.arcsec).value for x in swept['atmosphere.seeing']]).reshape([-1 if name == 'atmosphere.seeing' else 1 for name in names] + [1])
+        if 'source.flux' in names:
+            grid['source_flux'] = evaluate(['source.flux'], source_flux)
+        if 'atmosphere.airmass' in names or 'atmosphere.water_vapor' in names:
+            grid['transmission'] = evaluate(['atmosphere.airmass', 'atmosphere.water_vapor'], lambda parameters: atmosphere(parameters).get_transmission(self.wavelengths).to(u.dimensionless_unscaled).value)
+            grid['emission'] = evaluate(['atmosphere.airmass', 'atmosphere.water_vapor'], lambda parameters: atmosphere(parameters).get_emission(self.wavelengths).to(_EMISSION).value)
+        inputs = self._canonical_inputs(grid)
+
+        if 'exposure' in names:
+            integration_time = parameter('exposure', u.s) * inputs['number_exposures']
+            snr = Engine.signal_noise_ratio(inputs['source_rate'], inputs['background_rate'], inputs['dark_current_rate'], inputs['read_noise'], integration_time, inputs['number_exposures'])
+            return u.Quantity(snr * ones(shape), u.dimensionless_unscaled)
+        else:
+            snr = parameter('signal_noise_ratio', u.dimensionless_unscaled) * ones(shape)
+            integration_time = Engine.integration_time(inputs['source_rate'], inputs['background_rate'], inputs['dark_current_rate'], inputs['read_noise'], snr, inputs['number_exposures'])
+            return u.Quantity(integration_time / inputs['number_exposures'] * ones(shape), u.s)
+
+    def set_parameters(self, parameters, run_calculator=True):
         # Validate input format
         if isinstance(parameters, str):
             try:
@@ -192,21 +547,23 @@ class exposure_time_calculator:
 
         # Set each parameter, then calculate results
         errors = ''
-        # Handle b64 values first, removing the indicator 'b64' from key
-        for key, val in [ (key, val) for key, val in parameters.items() if 'b64' in key]:
-            try:
-                self.set_parameter(key.replace('b64',''), val, run_calculator=False)
-                parameters.pop(key)
-            except Exception as e:
-                errors += str(e).split(' -- ')[-1] + '\n'
-        # Set all other values
-        for key, val in parameters.items():
-            try:
-                self.set_parameter(key, val, run_calculator=False)
-            except Exception as e:
-                errors += str(e).split(' -- ')[-1] + '\n'
+        with Metrics.stage('set_parameters'):
+            # Handle b64 values first, removing the indicator 'b64' from key
+            for key, val in [ (key, val) for key, val in parameters.items() if 'b64' in key]:
+                try:
+                    self.set_parameter(key.replace('b64',''), val, run_calculator=False)
+                    parameters.pop(key)
+                except Exception as e:
+                    errors += str(e).split(' -- ')[-1] + '\n'
+            # Set all other values
+            for key, val in parameters.items():
+                try:
+                    self.set_parameter(key, val, run_calculator=False)
+                except Exception as e:
+                    errors += str(e).split(' -- ')[-1] + '\n'
 
-        self._calculate()
+        if run_calculator:
+            self._calculate()
         if len(errors) > 0:
             raise ValueError(f'In ETC.set_parameters() -- encountered the following errors: \n{errors}')
 
@@ -238,6 +595,7 @@ class exposure_time_calculator:
                 self.instrument.set_parameter(name.replace('instrument.',''), value)
                 # Calculate default wavelengths array from min, max of instrument
                 self.wavelengths = linspace(self.instrument.min_wavelength, self.instrument.max_wavelength, self.config.defaults.default_wavelengths_number).to(u.angstrom)
+                self.atmosphere.set_window(self.instrument.min_wavelength, self.instrument.max_wavelength)
                 # If setting a different instrument, reset wavelength band and wavelengths according to instrument defaults
                 if name == 'instrument.name':
                     # Set default wavelength band according to range of instrument
@@ -258,17 +616,19 @@ class exposure_time_calculator:
                 if value != 'signal_noise_ratio' and value != 'exposure':
                     raise ValueError('In ETC.set_parameter() -- target must be either "exposure" or "signal_noise_ratio"')
                 if value == 'exposure' and self.target == 'signal_noise_ratio':
-                    self.signal_noise_ratio = [u.Quantity(x) for x in self.config.defaults.signal_noise_ratio] * u.dimensionless_unscaled
+                    self.signal_noise_ratio = self.config.defaults.signal_noise_ratio
                 elif value == 'signal_noise_ratio' and self.target == 'exposure':
-                    self.exposure = [u.Quantity(x) for x in self.config.defaults.exposure] * u.s
+                    self.exposure = self.config.defaults.exposure
                 self.target = value
             elif name == 'wavelengths':
+                value = _parse_list(value)
                 if isinstance(value, str):
                     value = [value]
                 elif not isinstance(value, list):
                     value = list(value)
                 self.wavelengths = [u.Quantity(x).to(u.angstrom) for x in value] * u.angstrom
             elif name == 'exposure':
+                value = _parse_list(value)
                 if isinstance(value, str):
                     value = [value]
                 elif not isinstance(value, list):
@@ -276,6 +636,7 @@ class exposure_time_calculator:
                 self.target = 'signal_noise_ratio'
                 self.exposure = [u.Quantity(x).to(u.s) for x in value] * u.s
             elif name == 'signal_noise_ratio':
+                value = _parse_list(value)
                 if isinstance(value, str):
                     value = [value]
                 elif not isinstance(value, list):
@@ -288,6 +649,49 @@ class exposure_time_calculator:
         if run_calculator:
             self._calculate()
 
+    def _find_options(self, obj, name):
+        # Look for available options in config, returning None if there aren't any
+        options = None
+        if name+'_options' in obj.config:
+            options = obj.config[name+'_options']
+        # Since instrument config is arranged differently, check for options under config.mode
+        if self.instrument.mode in obj.config and name+'_options' in obj.config[self.instrument.mode]:
+            options = obj.config[self.instrument.mode][name+'_options']
+
+        if isinstance(options, (tuple, u.Quantity)):
+            # Options that are pairs of values, i.e. slit [width, length] or binning [spatial, spectral]
+            if len(options) > 0 and isinstance(options[0], (tuple, u.Quantity)):
+                parameter = {'options': [ {'value': u.Quantity(option).value.tolist()} for option in options ]}
+                if u.Quantity(options[0]).unit != u.dimensionless_unscaled:
+                    parameter['unit'] = str(u.Quantity(options[0]).unit)
+            else:
+                parameter = {'options': [ {'value': option} for option in options ]}
+        elif options is not None:
+            parameter = {'options': [ {'value': x} for x in options.keys()]}
+        else:
+            return None
+
+        # Name instrument slits, i.e. 0.5" x 10"
+        if obj is self.instrument and name == 'slit':
+            for slit in parameter['options']:
+                slit['name'] = f'{slit["value"][0]}" x {slit["value"][1]}"'
+            if self.instrument.config[self.instrument.mode].custom_slits:
+                parameter['options'] += [{'value': 'Custom'}]
+        return parameter
+
+    def _parameter_options(self, obj, name):
+        # Options only depend on the instrument and mode, so they're found once for each and shared by every call to get_parameters()
+        key = (self.instrument.name, self.instrument.mode, type(obj).__name__, name)
+        if key not in _PARAMETER_OPTIONS.keys():
+            _PARAMETER_OPTIONS[key] = self._find_options(obj, name)
+        return _PARAMETER_OPTIONS[key]
+
+    def _wavelength_bands(self):
+        # Center of each wavelength band in angstrom
+        if 'wavelength_bands' not in _PARAMETER_OPTIONS.keys():
+            _PARAMETER_OPTIONS['wavelength_bands'] = {band: wavelength.to(u.angstrom).value for band, wavelength in self.source.config.wavelength_band_options.items()}
+        return _PARAMETER_OPTIONS['wavelength_bands']
+
     def get_parameters(self):
         # Define method to format data
         def construct_parameters(obj, names):
@@ -302,24 +706,11 @@ class exposure_time_calculator:
                         parameters[name]['unit'] = str(vars(obj)[name].unit)
                 else:
                     parameters[name] = { 'value': vars(obj)[name]}
-                
-                # Look for available options in config
-                options = None
-                if name+'_options' in vars(obj.config).keys():
-                    options = vars(obj.config)[name+'_options']
-                # Since instrument config is arranged differently, check for options under config.mode
-                if self.instrument.mode in vars(obj.config).keys() and name+'_options' in vars(vars(obj.config)[self.instrument.mode]).keys():
-                    options = vars(vars(obj.config)[self.instrument.mode])[name+'_options']
-                
-                if isinstance(options, list):
-                    if len(options) > 0 and isinstance(options[0], list):
-                        parameters[name]['options'] = [ {'value': [u.Quantity(option[0]).value, u.Quantity(option[1]).value]} for option in options ]
-                        if u.Quantity(options[0][0]).unit != u.dimensionless_unscaled:
-                            parameters[name]['unit'] = str(u.Quantity(options[0][0]).unit)
-                    else:
-                        parameters[name]['options'] = [ {'value': option} for option in options ]
-                elif options is not None:
-                    parameters[name]['options'] = [ {'value': x} for x in vars(options).keys()]
+
+                # Add options and their unit, which are shared w/ other calls and must not be modified
+                options = self._parameter_options(obj, name)
+                if options is not None:
+                    parameters[name].update(options)
             return parameters
 
         # Add self parameters
@@ -337,20 +728,22 @@ class exposure_time_calculator:
         # Add instrument name
         parameters['name'] = { 'value': self.instrument.name }
         # Update source type
-        parameters['type']['options'] = [{'value': x, 'name': vars(self.source.config.source_types)[x].name} 
-                                        if 'name' in vars(vars(self.source.config.source_types)[x]).keys() 
-                                        else {'value': x} for x in self.source.available_types]
-        # Update instrument slit
-        for slit in parameters['slit']['options']:
-            slit['name'] = f'{slit["value"][0]}" x {slit["value"][1]}"'
-        if vars(self.instrument.config)[self.instrument.mode].custom_slits:
-            parameters['slit']['options'] += [{'value': 'Custom'}]
+        # Uploaded templates aren't in the source config, so they're named after their filename
+        parameters['type']['options'] = [{'value': x, 'name': self.source.config.source_types[x].name} 
+                                        if x in self.source.config.source_types 
+                                        else {'value': x, 'name': x} for x in self.source.available_types]
         # Format wavelength band so that { value: K, options: [K,...] } --> { value: 21900, options: [ {name: K, value: 21900}, ... ] }
-        options = { key: val for key, val in vars(self.source.config.wavelength_band_options).items() if self.wavelengths[0] <= u.Quantity(val) <= self.wavelengths[-1] }
+        bands = self._wavelength_bands()
+        low, high = self.wavelengths[0].to(u.angstrom).value, self.wavelengths[-1].to(u.angstrom).value
+        options = { key: val for key, val in bands.items() if low <= val <= high }
         if self.source.wavelength_band not in options.keys():
-            options[self.source.wavelength_band] = vars(self.source.config.wavelength_band_options)[self.source.wavelength_band]
-        parameters['wavelength_band']['value'] = round(u.Quantity(options[parameters['wavelength_band']['value']]).to(u.angstrom).value)
-        parameters['wavelength_band']['options'] = [{ 'name': band, 'value': round(u.Quantity(wavelength).to(u.angstrom).value) } for band, wavelength in options.items() ]
+            options[self.source.wavelength_band] = bands[self.source.wavelength_band]
+        parameters['wavelength_band']['value'] = round(options[parameters['wavelength_band']['value']])
+        parameters['wavelength_band']['options'] = [{ 'name': band, 'value': round(wavelength) } for band, wavelength in options.items() ]
+
 
+        return parameters
 
-        return parameters
\ No newline at end of file
+    def get_parameter_options(self):
+        # Parameters w/o their current values, which only change w/ the instrument, mode, and uploaded templates
+        return {name: {key: val for key, val in parameter.items() if key != 'value'} for name, parameter in self.get_parameters().items()}
\ No newline at end of file
@@ -0,0 +1,52 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+# Unit-free versions of the ETC equations, operating on float64 ndarrays in canonical units:
+# photon / (cm^2 s angstrom) for flux, arcsec for angles, s for time, and electron for counts.
+# All functions broadcast over their inputs.
+
+from numpy import pi, arccos, sqrt, where, copysign, errstate, NaN
+
+
+def solve_quadratic(a, b, c):
+    # Real roots of a*x^2 + b*x + c = 0, broadcast over a, b, c, returning the roots (-b + sqrt(b^2-4ac)) / 2a and (-b - sqrt(b^2-4ac)) / 2a
+    # Uses q = -(b + sign(b) * sqrt(b^2-4ac)) / 2 to avoid cancellation, see Numerical Recipes 5.6
+    with errstate(divide='ignore', invalid='ignore'):
+        discriminant = b**2 - 4*a*c
+        # Roots are NaN wherever they're complex or the equation isn't quadratic
+        invalid = (discriminant < 0) | (a == 0)
+        q = -(b + copysign(sqrt(where(invalid, 0, discriminant)), b)) / 2
+        root_q = where(invalid, NaN, q / a)
+        root_c = where(invalid | (q == 0), NaN, c / q)
+    # For b >= 0, q / a is the negative root, otherwise it's the positive root
+    return where(b < 0, root_q, root_c), where(b < 0, root_c, root_q)
+
+
+def source_size(seeing, slit_width):
+    # Area of circular point source inside the slit, i.e. area of circle minus area of segments occluded by slit
+    with errstate(invalid='ignore'):
+        area_occluded = where(seeing > slit_width, (seeing**2 * arccos(slit_width / seeing) - slit_width * sqrt(seeing**2 - slit_width**2)) / 2, 0)
+    return pi * (seeing/2)**2 - area_occluded
+
+
+def signal_noise_ratio(source_rate, background_rate, dark_current_rate, read_noise, integration_time, number_exposures):
+    # Signal to noise ratio = signal / sqrt(noise), w/ counts in e- for whole slit and exposure
+    source_count = source_rate * integration_time
+    noise_count = source_count + (background_rate + dark_current_rate) * integration_time + read_noise * number_exposures
+    return source_count / sqrt(noise_count)
+
+
+def integration_time(source_rate, background_rate, dark_current_rate, read_noise, signal_noise_ratio, number_exposures):
+    # Solve a*t^2 + b*t + c = 0 for t, returning NaN where no non-negative solution exists
+    a = source_rate**2
+    b = - signal_noise_ratio**2 * (background_rate + dark_current_rate + source_rate) / number_exposures
+    c = - read_noise * signal_noise_ratio**2 / number_exposures
+    # Use the positive root where it exists, otherwise the negative root, and mark anything else as NaN
+    time_pos, time_neg = solve_quadratic(a, b, c)
+    time = where(time_pos >= 0, time_pos, time_neg)
+    time[~(time >= 0)] = NaN  # Also true for NaN
+    return time
@@ -5,62 +5,120 @@
 # LICENSE file in the root directory of this source tree. 
 
 
-import yaml
 from astropy.table import Table
 import astropy.units as u
-from numpy import interp, NaN, isnan
+from numpy import interp, NaN, isnan, ascontiguousarray
 from warnings import warn
 from re import split
 from os import listdir
+from os.path import isdir
+import Snapshot
+import Config
+from Config import quantity, quantities, optional
+
+
+# Instrument parameters used to select a throughput file, and the corresponding metadata keys
+_THROUGHPUT_KEYS = [('mode', 'MODE'), ('filter', 'FILTER'), ('grating', 'GRATING'), ('grism', 'GRISM'), ('dichroic', 'DICHROIC')]
+
+# Config and throughput data for each loaded instrument, shared by all instances and not modified once loaded
+_registry = {}
+
+# Values for each mode in instrument_config.yaml
+_MODE_SCHEMA = {
+    'pixel_size': quantity(u.arcsec**2 / u.pixel),
+    'spectral_resolution': quantity(u.dimensionless_unscaled),
+    'nonlinear_depth': quantity(u.adu),
+    'gain': quantity(u.electron / u.adu),
+    'read_noise': quantity((u.electron / u.pixel)**(1/2)),
+    'dark_current': quantity(u.electron / (u.pixel * u.s)),
+    'grating_options': [str],
+    'filter_options': [str],
+    'grism_options': [str],
+    'dichroic_options': [str],
+    'binning_options': [[int]],
+    'slit_options': quantities(u.arcsec),
+    'custom_slits': bool
+}
+
+# Values in instrument_config.yaml, w/ a section for each mode, see Config.py
+# Sections for modes that aren't in mode_options may be left empty
+_CONFIG_SCHEMA = {
+    'defaults': {
+        'grating': optional(str),
+        'grism': optional(str),
+        'filter': optional(str),
+        'dichroic': optional(str),
+        'slit': quantities(u.arcsec),
+        'wavelength_band': str,
+        'binning': [int],
+        'mode': str
+    },
+    'mode_options': [str],
+    'throughput_path': str,
+    'exposure_options': [str],
+    '*': optional(_MODE_SCHEMA)
+}
+
+
+def _read_throughput_file(filepath):
+    # Throughput as contiguous arrays w/ their metadata, avoiding table column access on every lookup
+    data = Table.read(filepath, format='fits')
+    return {
+        'WAV': ascontiguousarray(data['WAV'], dtype=float),
+        'EFF': ascontiguousarray(data['EFF'], dtype=float),
+        'unit': data['WAV'].unit,
+        'meta': dict(data.meta)
+    }
+
+def _read_config_file(filepath):
+    return Config.load(filepath, _CONFIG_SCHEMA)
+
+def preload_instruments(names):
+    # Load every available instrument up front, so that switching instruments never reads from disk
+    for name in names:
+        if isdir('calculator/instruments/'+name):
+            instrument(name)
 
 class instrument:
 
     def _mount_config(self, config_path):
-        # From https://www.geeksforgeeks.org/convert-nested-python-dictionary-to-object/
-        def _dict2obj(d):
-            # If list, recursively unpack
-            if isinstance(d, list):
-                d = [_dict2obj(x) for x in d]
-            # If not list or dictionary, return object
-            if not isinstance(d, dict):
-                return d
-            # Otherwise, create dummy object
-            class GenericObject:
-                pass
-            obj = GenericObject()
-            # Loop over dictionary items and add to object
-            for x in d:
-                obj.__dict__[x] = _dict2obj(d[x])
-            return obj
-        # Open config file, convert & mount to self
-        config = yaml.safe_load(open(config_path))
-        config = _dict2obj(config)
-        self.config = config
-        
+        self.config = Snapshot.read(config_path, _read_config_file)
+
+
+    def _validate_config(self):
+        # Throw errors if config values are inconsistent, values and their units are already checked against _CONFIG_SCHEMA when loaded
+        filename = f'calculator/instruments/{self.name}/instrument_config.yaml'
+        if self.config.defaults.mode not in self.config.mode_options:
+            raise ValueError(f'ERROR: In {filename} -- default mode is not in mode_options')
+        for mode in self.config.mode_options:
+            if mode not in self.config:
+                raise ValueError(f'ERROR: In {filename} -- missing required values for {mode} mode')
+        config = self.config[self.config.defaults.mode]
+        # Default grating, filter, grism, and dichroic must be available in the default mode
+        for name in ['grating', 'filter', 'grism', 'dichroic']:
+            if name in self.config.defaults and self.config.defaults[name] not in config[name+'_options']:
+                raise ValueError(f'ERROR: In {filename} -- default {name} is not in {name}_options for {self.config.defaults.mode} mode')
+        if tuple(self.config.defaults.binning) not in config.binning_options:
+            raise ValueError(f'ERROR: In {filename} -- default binning is not in binning_options for {self.config.defaults.mode} mode')
+        if not config.custom_slits and not any([(self.config.defaults.slit == x).all() for x in config.slit_options]):
+            raise ValueError(f'ERROR: In {filename} -- default slit is not in slit_options for {self.config.defaults.mode} mode, and custom_slits is false')
+
 
     def _update_wavelengths(self):
-        self.min_wavelength = self._current_throughput()['WAV'][0] * self._current_throughput()['WAV'].unit
-        self.max_wavelength = self._current_throughput()['WAV'][-1] * self._current_throughput()['WAV'].unit
+        throughput = self._current_throughput()
+        self.min_wavelength = throughput['WAV'][0] * throughput['unit']
+        self.max_wavelength = throughput['WAV'][-1] * throughput['unit']
 
 
     def _current_throughput(self):
-        # Gather applicable parameters for proper throughput file
-        parameters = {}
-        if 'mode' in vars(self).keys():
-            parameters['MODE'] = self.mode
-        if 'filter' in vars(self).keys():
-            parameters['FILTER'] = self.filter
-        if 'grating' in vars(self).keys():
-            parameters['GRATING'] = self.grating
-        if 'grism' in vars(self).keys():
-            parameters['GRISM'] = self.grism
-        if 'dichroic' in vars(self).keys():
-            parameters['DICHROIC'] = self.dichroic
-        # Select throughput file matching instrument parameters
-        result = None
-        for throughput in self._throughput:
-            if all([ throughput.meta[key] == val for key, val in parameters.items() ]):
-                result = throughput
+        # Gather applicable parameters for proper throughput file, parameters that aren't set match any file
+        names = tuple(key for attribute, key in _THROUGHPUT_KEYS if attribute in vars(self).keys())
+        values = tuple(vars(self)[attribute] for attribute, key in _THROUGHPUT_KEYS if attribute in vars(self).keys())
+        # Index throughput files by the values of these parameters, built once for each set of parameters
+        if names not in self._throughput_index.keys():
+            # If multiple files match, the last one read is used
+            self._throughput_index[names] = { tuple(throughput['meta'][key] for key in names): throughput for throughput in self._throughput }
+        result = self._throughput_index[names].get(values)
         # If no throughput files matched, instrument mode/grating/filter/grism combination is invalid
         if result is None:
             raise ValueError('In instrument.get_throughput() -- instrument mode/grating/filter/grism combination is invalid')
@@ -70,11 +128,23 @@ class instrument:
 
     def _read_throughput(self):
         self._throughput = []
+        self._throughput_index = {}
         directory = 'calculator/instruments/'+self.name+'/'+self.config.throughput_path
         for filename in listdir(directory):
-            data = Table.read(directory + '/' + filename, format='fits')
-            data['EFF'].unit = u.electron / u.photon
-            self._throughput.append(data)
+            self._throughput.append(Snapshot.read(directory + '/' + filename, _read_throughput_file))
+
+
+    def _load(self, name):
+        # Mount config and throughput data from registry, reading files only the first time an instrument is used
+        if name not in _registry.keys():
+            self._mount_config('calculator/instruments/'+name+'/instrument_config.yaml')
+            self.name = name
+            self._validate_config()
+            self._read_throughput()
+            _registry[name] = {'config': self.config, 'throughput': self._throughput, 'throughput_index': self._throughput_index}
+        self.config = _registry[name]['config']
+        self._throughput = _registry[name]['throughput']
+        self._throughput_index = _registry[name]['throughput_index']
 
 
     def __init__(self, name):
@@ -85,11 +155,16 @@ class instrument:
 
     def get_throughput(self, wavelengths):
         data = self._current_throughput()
-        throughput = interp(wavelengths, data['WAV'], data['EFF'], left=NaN, right=NaN)
+        # Convert throughput wavelengths to the unit of wavelengths, so that bounds are compared exactly
+        throughput = interp(wavelengths.value, data['WAV'] * data['unit'].to(wavelengths.unit), data['EFF'], left=NaN, right=NaN)
         if isnan(throughput).any():
             warn('In instrument.get_throughput() -- ' +
-            'some or all provided wavelengths are outside the current bounds of ['+str(min(data['WAV']))+', '+str(max(data['WAV']))+'] '+str(data['WAV'].unit)+', returning NaN', RuntimeWarning)
-        return u.Quantity(throughput, data['EFF'].unit)
+            'some or all provided wavelengths are outside the current bounds of ['+str(min(data['WAV']))+', '+str(max(data['WAV']))+'] '+str(data['unit'])+', returning NaN', RuntimeWarning)
+        return u.Quantity(throughput, u.electron / u.photon)
+
+    def get_configuration(self):
+        # Instrument name and the parameters that select its throughput file, i.e. ('lris', 'spectroscopy', 'CLEAR', '600/7500', ...)
+        return (self.name,) + tuple(vars(self)[attribute] for attribute, key in _THROUGHPUT_KEYS if attribute in vars(self).keys())
 
     def get_dark_current(self):
         return self._dark_current
@@ -99,32 +174,29 @@ class instrument:
 
     def set_mode(self, mode):
         self.mode = mode
-        config = vars(self.config)[self.mode]
-        self.gain = u.Quantity(config.gain)
-        self.pixel_size = u.Quantity(config.pixel_size)
-        self._dark_current = u.Quantity(config.dark_current)
-        self._read_noise = u.Quantity(config.read_noise)
-        self.spectral_resolution = u.Quantity(config.spectral_resolution)
-        self.nonlinear_depth = u.Quantity(config.nonlinear_depth)
-        self.slit_options = [ [u.Quantity(x) for x in y] * u.arcsec for y in config.slit_options] * u.arcsec
+        config = self.config[self.mode]
+        self.gain = config.gain
+        self.pixel_size = config.pixel_size
+        self._dark_current = config.dark_current
+        self._read_noise = config.read_noise
+        self.spectral_resolution = config.spectral_resolution
+        self.nonlinear_depth = config.nonlinear_depth
+        self.slit_options = config.slit_options
 
     def set_name(self, name):
         # Throw error if name is not valid
-        try:
-            listdir('calculator/instruments/'+name)
-        except:
+        if name not in _registry.keys() and not isdir('calculator/instruments/'+name):
             raise ValueError('Error: In instrument.set_parameter() -- instrument '+name+' is not a valid option')
 
         self.__dict__ = {}  # clear parameters from previous instrument
-        config_filepath = 'calculator/instruments/'+name+'/instrument_config.yaml'
-        self._mount_config(config_filepath)
+        self._load(name)
         self.name = name
         
-        self.slit = [u.Quantity(x) for x in self.config.defaults.slit] * u.arcsec
+        self.slit = self.config.defaults.slit
         self.active_parameters = ['name', 'slit', 'mode', 'binning']
         for parameter in ['grating', 'grism', 'filter', 'dichroic']:
-            if parameter in vars(self.config.defaults).keys():
-                vars(self)[parameter] = vars(self.config.defaults)[parameter]
+            if parameter in self.config.defaults:
+                vars(self)[parameter] = self.config.defaults[parameter]
                 self.active_parameters.append(parameter)
         # More explicit aliases for slit
         self.slit_width = self.slit[0]
@@ -134,7 +206,6 @@ class instrument:
 
         self.set_mode(self.config.defaults.mode)
         
-        self._read_throughput()
         self._update_wavelengths()
 
     def set_parameter(self, name, value):
@@ -147,22 +218,22 @@ class instrument:
             self.set_mode(str(value).lower())
             self._update_wavelengths()
         elif name == 'grating':
-            if value not in vars(self.config)[self.mode].grating_options:
+            if value not in self.config[self.mode].grating_options:
                 raise ValueError(f'In instrument.set_parameter() -- "{value}" is not a valid grating')
             self.grating = str(value).upper()
             self._update_wavelengths()
         elif name == 'filter':
-            if value not in vars(self.config)[self.mode].filter_options:
+            if value not in self.config[self.mode].filter_options:
                 raise ValueError(f'In instrument.set_parameter() -- "{value}" is not a valid filter')
             self.filter = str(value).upper()
             self._update_wavelengths()
         elif name == 'grism':
-            if value not in vars(self.config)[self.mode].grism_options:
+            if value not in self.config[self.mode].grism_options:
                 raise ValueError(f'In instrument.set_parameter() -- "{value}" is not a valid grism')
             self.grism = str(value).upper()
             self._update_wavelengths()
         elif name == 'dichroic':
-            if value not in vars(self.config)[self.mode].dichroic_options:
+            if value not in self.config[self.mode].dichroic_options:
                 raise ValueError(f'In instrument.set_parameter() -- "{value}" is not a valid dichroic')
             self.dichroic = str(value).upper()
             self._update_wavelengths()
@@ -171,13 +242,13 @@ class instrument:
                 value = [int(x) for x in split('x|,', value)]
             elif isinstance(value, list):
                 value = [int(x) for x in value]
-            if value not in vars(self.config)[self.mode].binning_options or not isinstance(value, list):
+            if not isinstance(value, list) or tuple(value) not in self.config[self.mode].binning_options:
                 raise ValueError(f'In instrument.set_parameter() -- "{value}" is not a valid binning value')
             self.binning = u.Quantity(value)
         elif name == 'slit':
             # If value is "custom", reset to default
             if str(value).lower() == 'custom':
-                self.slit = [u.Quantity(x) for x in self.config.defaults.slit] * u.arcsec
+                self.slit = self.config.defaults.slit
                 self.slit_width = self.slit[0]
                 self.slit_length = self.slit[1]
             else:
@@ -187,7 +258,7 @@ class instrument:
                 try:
                     # If dimensionless, assume arcsec
                     value = [u.Quantity(x) * u.arcsec if u.Quantity(x).unit==u.dimensionless_unscaled else u.Quantity(x) for x in value] * u.arcsec
-                    if (not vars(self.config)[self.mode].custom_slits) and (not any([(value==x).all() for x in self.slit_options])):
+                    if (not self.config[self.mode].custom_slits) and (not any([(value==x).all() for x in self.slit_options])):
                         raise ValueError()
                     self.slit = value
                     self.slit_width = self.slit[0]
@@ -0,0 +1,97 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+# Timing of each stage of a request, i.e. with Metrics.stage('calculate.source'): ...
+# Stages are only timed between begin() and end(), so calculators used outside the API aren't slowed down
+# If enabled, end() adds the timings to latency histograms by stage and instrument, for the /metrics endpoint
+
+from time import perf_counter
+from bisect import bisect_left
+
+# Upper bounds of histogram buckets in seconds, w/ a final bucket for anything slower
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+enabled = False
+_timings = None  # Seconds spent in each stage of the current request, None when not timing
+_start = None
+_requests = {}  # Request and error counts by instrument
+_histograms = {}  # Bucket counts, count, and sum by (stage, instrument)
+
+
+class _stage:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exception):
+        # Stages entered more than once per request (i.e. for each query in a batch) are summed
+        if _timings is not None:
+            _timings[self.name] = _timings.get(self.name, 0) + perf_counter() - self.start
+
+
+class _no_stage:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exception):
+        pass
+
+_NO_STAGE = _no_stage()
+
+
+def stage(name):
+    return _NO_STAGE if _timings is None else _stage(name)
+
+
+def begin():
+    # Start timing a request
+    global _timings, _start
+    _timings = {}
+    _start = perf_counter()
+
+
+def timings():
+    # Timings of stages finished so far in the current request, in seconds
+    return dict(_timings) if _timings is not None else {}
+
+
+def end(instrument, error=False):
+    # Stop timing the current request, adding its total time as the stage 'request'
+    global _timings
+    if _timings is None:
+        return
+    _timings['request'] = perf_counter() - _start
+    if enabled:
+        counts = _requests.setdefault(instrument, {'requests': 0, 'errors': 0})
+        counts['requests'] += 1
+        counts['errors'] += int(error)
+        for name, seconds in _timings.items():
+            histogram = _histograms.setdefault((name, instrument), [[0] * (len(BUCKETS) + 1), 0, 0.0])
+            histogram[0][bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+    _timings = None
+
+
+def report():
+    # Counts and histograms recorded by this process, w/ cumulative bucket counts keyed by upper bound
+    stages = {}
+    for (name, instrument), (buckets, count, total) in sorted(_histograms.items()):
+        cumulative = [sum(buckets[:idx+1]) for idx in range(len(buckets))]
+        stages.setdefault(name, {})[instrument] = {
+            'count': count,
+            'sum': total,
+            'mean': total / count,
+            'buckets': dict(zip([str(x) for x in BUCKETS] + ['+Inf'], cumulative))
+        }
+    return {'enabled': enabled, 'requests': _requests, 'stages': stages}
@@ -0,0 +1,95 @@
+# Copyright (c) 2022, W. M. Keck Observatory
+# All rights reserved.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+# Snapshot of data read from files while loading the etc, saved so that later starts can skip reading and parsing them
+# Each entry is reused only while the size and checksum of its file are unchanged
+# The whole snapshot is rebuilt when the source code of the calculator changes, since that can change how files are parsed
+
+import pickle
+from os import stat, replace, getpid, makedirs, listdir
+from os.path import dirname, normpath, abspath, join
+from zlib import crc32
+from hashlib import sha1
+from warnings import warn
+
+_VERSION = 2  # Increase when the format of saved data changes, so that older snapshots are rebuilt
+
+_filepath = None  # Snapshot isn't used unless mounted
+_entries = {}
+_used = set()
+_changed = False
+_version = None  # Format version and checksum of source code when mounted
+
+
+def _source_checksum():
+    # Checksum of every module in this directory, i.e. readers, config schemas, and Config.py
+    directory = dirname(abspath(__file__))
+    checksum = sha1()
+    for filename in sorted(x for x in listdir(directory) if x.endswith('.py')):
+        with open(join(directory, filename), 'rb') as file:
+            checksum.update(filename.encode() + b'\0' + file.read())
+    return checksum.hexdigest()
+
+
+def _file_checksum(filepath):
+    # Read in full every time, so that files changed w/o changing their modification time (i.e. cp -p, rsync -a) are still read again
+    checksum = 0
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            checksum = crc32(chunk, checksum)
+    return checksum
+
+
+def mount(filepath):
+    # Load saved entries from filepath, starting empty if it doesn't exist or is from another version or source code
+    global _filepath, _entries, _used, _changed, _version
+    _filepath = filepath
+    _entries = {}
+    _used = set()
+    _changed = False
+    _version = (_VERSION, _source_checksum())
+    try:
+        with open(filepath, 'rb') as file:
+            snapshot = pickle.load(file)
+        if snapshot['version'] == _version:
+            _entries = snapshot['entries']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        warn(f'In Snapshot.mount() -- unable to read {filepath}, rebuilding\n{e}', RuntimeWarning)
+
+
+def read(filepath, reader):
+    # Return reader(filepath), reusing the saved result if the file hasn't changed since it was read
+    global _changed
+    if _filepath is None:
+        return reader(filepath)
+    key = (reader.__module__ + '.' + reader.__qualname__, normpath(filepath))
+    fingerprint = (stat(filepath).st_size, _file_checksum(filepath))
+    _used.add(key)
+    if key in _entries.keys() and _entries[key][0] == fingerprint:
+        return _entries[key][1]
+    value = reader(filepath)
+    _entries[key] = (fingerprint, value)
+    _changed = True
+    return value
+
+
+def save():
+    # Write entries read since mounting to the snapshot file, if any have changed
+    # Written to a temporary file first, so that other processes never read a partial snapshot
+    if _filepath is None or not (_changed or _used != set(_entries.keys())):
+        return
+    try:
+        makedirs(dirname(_filepath) or '.', exist_ok=True)
+        temporary = f'{_filepath}.{getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            pickle.dump({'version': _version, 'entries': {key: _entries[key] for key in _used}}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temporary, _filepath)
+    except Exception as e:
+        warn(f'In Snapshot.save() -- unable to write {_filepath}\n{e}', RuntimeWarning)
+
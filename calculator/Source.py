@@ -1,12 +1,55 @@
-import yaml
 from astropy.table import Table
 from io import BytesIO
 from numpy import interp as interpolate
-from numpy import NaN, isnan, exp, log, sqrt, pi, log10
+from numpy import NaN, isnan, exp, log, sqrt, pi, log10, log2
 from astropy.constants import c, h, k_B
 import astropy.units as u
 from base64 import b64decode
 from warnings import warn
+from hashlib import sha1
+from copy import copy
+from Cache import bounded_cache
+import Snapshot
+import Config
+from Config import quantity, optional
+
+
+def _read_template_file(filepath):
+    # Wavelength and flux quantities of a template
+    data = Table.read(filepath, format='ascii.ecsv')
+    return data['wavelength'].quantity, data['flux'].quantity
+
+
+# Values in source_config.yaml, see Config.py
+_CONFIG_SCHEMA = {
+    'defaults': {
+        'type': str,
+        'flux': str,  # Parsed by source.set_flux(), since magnitudes in vega are defined by the source
+        'wavelength_band': str,
+        'redshift': quantity(u.dimensionless_unscaled)
+    },
+    'source_types': {
+        '*': {
+            'name': str,
+            'filename': optional(str),
+            'parameters': optional({'*': quantity()})
+        }
+    },
+    'template_filepath': str,
+    'vega_filename': str,
+    'spectrum_cache_size': int,
+    'equivalency_cache_size': int,
+    'template_cache_size': int,
+    'template_cache_bytes': int,
+    'wavelength_band_options': {'*': quantity(u.m)}
+}
+
+# Suffixes of magnitudes handled by source.set_flux()
+_MAGNITUDES = ['magab', 'abmag', 'mag(ab)', 'magst', 'stmag', 'mag(st)', 'magbol', 'bolmag', 'mag(bol)', 'magvega', 'vegamag', 'mag(vega)']
+
+
+def _read_config_file(filepath):
+    return Config.load(filepath, _CONFIG_SCHEMA)
 
 
 class source:
@@ -14,88 +57,78 @@ class source:
     global _CONFIG_FILEPATH; _CONFIG_FILEPATH = 'calculator/source/source_config.yaml'
 
     def _mount_config(self, config_path):
-        # From https://www.geeksforgeeks.org/convert-nested-python-dictionary-to-object/
-        def _dict2obj(d):
-            # If list, recursively unpack
-            if isinstance(d, list):
-                d = [_dict2obj(x) for x in d]
-            # If not list or dictionary, return object
-            if not isinstance(d, dict):
-                return d
-
-            # Otherwise, create generic object
-            class GenericObject:
-                pass
-            obj = GenericObject()
-            # Loop over dictionary items and add to object
-            for x in d:
-                obj.__dict__[x] = _dict2obj(d[x])
-            return obj
-        # Open config file, convert & mount to self
-        config = yaml.safe_load(open(config_path))
-        config = _dict2obj(config)
-        self.config = config
+        self.config = Snapshot.read(config_path, _read_config_file)
 
 
     def _load_files(self):
         self._functions = {}
-
-        for name, source_type in vars(self.config.source_types).items():
-            if 'filename' in vars(source_type).keys():
-                data = Table.read(self.config.template_filepath+source_type.filename, format='ascii.ecsv')
-                def define_data_scope(data):  # Wrapper function to narrow the scope of data and make sure each interpolation uses its own dataset
-                    def scale_and_interpolate(w):
-                        wavelengths = data['wavelength'].to(u.angstrom) * (1 + self.redshift)  # Apply redshift
-                        light = data['flux'].to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(wavelengths) + self.spectral_density_vega(wavelengths.to(u.angstrom)))  # Convert to units of light
-                        central_wavelength = u.Quantity(vars(self.config.wavelength_band_options)[self.wavelength_band])  # Get central wavelength of passband
-                        light = light / interpolate(central_wavelength, wavelengths, light) * self.flux.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(central_wavelength) + self.spectral_density_vega(central_wavelength.to(u.angstrom)))  # Scale source by given mag/flux
-                        return interpolate(w, wavelengths, light, left=0, right=0)
+        # Redshifted and scaled template spectra for recently used parameters
+        self._spectra = bounded_cache(self.config.spectrum_cache_size)
+        # Uploaded templates by content, shared w/ forked sources
+        self._templates = bounded_cache(self.config.template_cache_size, self.config.template_cache_bytes)
+
+        for name, source_type in self.config.source_types.items():
+            if 'filename' in source_type:
+                data = Snapshot.read(self.config.template_filepath+source_type.filename, _read_template_file)
+                def define_data_scope(data, name):  # Wrapper function to narrow the scope of data and make sure each interpolation uses its own dataset
+                    def scale_and_interpolate(source, w):  # Takes the source as an argument, so that forked sources use their own parameters
+                        wavelengths, light = source._template_spectrum(name, data[0], data[1])
+                        return interpolate(w.to(u.angstrom).value, wavelengths, light, left=0, right=0) * u.photon / (u.cm**2 * u.s * u.angstrom)
                     return scale_and_interpolate
 
-                self._functions[name] = define_data_scope(data)  # Save function corresponding to this source
+                self._functions[name] = define_data_scope(data, name)  # Save function corresponding to this source
             else:
                 if name == 'blackbody':
-                    self._functions[name] = self._blackbody
+                    self._functions[name] = source._blackbody
                 elif name == 'emission':
-                    self._functions[name] = self._emission
+                    self._functions[name] = source._emission
                 elif name == 'power':
-                    self._functions[name] = self._power_law
+                    self._functions[name] = source._power_law
                 elif name == 'flat':
-                    self._functions[name] = self._flat
+                    self._functions[name] = source._flat
                 else:
                     raise ValueError('ERROR: In source_config.yaml -- source type '+name+' does not have either a defined template or function')
-                if 'parameters' in vars(source_type).keys():
-                    self.__dict__.update({key: u.Quantity(val) for key, val in vars(source_type.parameters).items()})
+                if 'parameters' in source_type:
+                    self.__dict__.update(source_type.parameters.items())
+
+
+    def _template_spectrum(self, key, wavelengths, flux):
+        # Return (wavelengths, light) in angstrom and photlam of template, redshifted and scaled to the current flux, reusing cached spectra when available
+        cache_key = (key, self.redshift.to(u.dimensionless_unscaled).value, self.wavelength_band, self.flux.value, self.flux.unit.to_string())
+        spectrum = self._spectra.get(cache_key)
+        if spectrum is None:
+            wavelengths = wavelengths.to(u.angstrom) * (1 + self.redshift)  # Apply redshift
+            light = flux.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=self._equivalencies(wavelengths))  # Convert to units of light
+            central_wavelength = self.config.wavelength_band_options[self.wavelength_band]  # Get central wavelength of passband
+            light = light / interpolate(central_wavelength, wavelengths, light) * self.flux.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=self._equivalencies(central_wavelength))  # Scale source by given mag/flux
+            spectrum = (wavelengths.to(u.angstrom).value, light.to(u.photon / (u.cm**2 * u.s * u.angstrom)).value)
+            self._spectra.put(cache_key, spectrum)
+        return spectrum
 
 
     def _validate_config(self):
-        # Throw errors if config file doesn't conform to requirements
+        # Throw errors if config values are inconsistent, values and their units are already checked against _CONFIG_SCHEMA when loaded
+        if self.config.defaults.type not in self.config.source_types:
+            raise ValueError('ERROR: In source_config.yaml -- default type is not in source_types')
+        if self.config.defaults.wavelength_band not in self.config.wavelength_band_options:
+            raise ValueError('ERROR: In source_config.yaml -- default wavelength_band is not in wavelength_band_options')
+        # Default flux is either a magnitude, or a quantity w/ units of spectral flux density
         try:
-            # Check that all required fields exist and are spelled correctly
-            _ = self.config.defaults.type
-            # TODO -- validation for self.config.defaults.flux here, needs extra because u.Quantity() errors out
-            _ = u.Quantity(self.config.defaults.redshift)
-            # TODO -- validate wavelength_bands and default.wavelength_band
-        except:
-            raise ValueError('ERROR: In source_config.yaml -- invalid configuration file')  # TODO -- specific error msg
-        # For each source type, check name (required), filename and parameters
-        for source_type in vars(self.config.source_types).values():
-            _ = source_type.name
-            # Check for valid template filenames
-            if 'filename' in vars(source_type).keys():
+            flux = self.config.defaults.flux.lower()
+            magnitudes = [x for x in _MAGNITUDES if flux.endswith(x)]
+            _ = float(flux.replace(magnitudes[0], '')) if len(magnitudes) > 0 else u.Quantity(flux)
+        except Exception:
+            raise ValueError('ERROR: In source_config.yaml -- default flux is not a valid magnitude or quantity')
+        if min(self.config.spectrum_cache_size, self.config.equivalency_cache_size, self.config.template_cache_size) < 1:
+            raise ValueError('ERROR: In source_config.yaml -- cache sizes must be at least 1')
+        # Check for valid template filenames
+        for source_type in self.config.source_types.values():
+            if 'filename' in source_type:
                 filepath = self.config.template_filepath + '/' + source_type.filename
                 try:
-                    data = Table.read(filepath, format='ascii.ecsv', data_end=10)
-                    _ = data['wavelength'].unit
-                    _ = data['flux'].unit
-                except:
-                    raise ValueError('ERROR: In source--config.yaml -- file '+filepath+' is not a valid ECSV file')
-            # Check parameters for valid astropy quantities
-            if 'parameters' in vars(source_type).keys():
-                try:
-                    _ = [u.Quantity(z) for z in vars(source_type.parameters).values()]
+                    _ = Snapshot.read(filepath, _read_template_file)  # Kept for loading templates, checks for wavelength and flux columns
                 except:
-                    raise ValueError('ERROR: In source_config.yaml -- invalid parameter for source type '+source_type.name)
+                    raise ValueError('ERROR: In source_config.yaml -- file '+filepath+' is not a valid ECSV file')
 
 
     def _define_units(self):
@@ -103,58 +136,57 @@ class source:
         self.flam = u.def_unit('flam', u.erg / (u.cm**2 * u.angstrom * u.s), format={'generic': 'flam', 'console': 'flam'})
         self.photlam = u.def_unit('photlam', u.photon / (u.cm**2 * u.angstrom * u.s), format={'generic': 'photlam', 'console': 'photlam'})
 
-        def define_data_scope(data):  # Wrapper function to narrow the scope of data and make sure each interpolation uses its own dataset
-                    def shift_and_interpolate(w):  # TODO -- Figure out why each function is returning the same results...
-                        wavelengths = data['wavelength'].to(u.angstrom) * (1 + self.redshift)  # Apply redshift
-                        light = data['flux'].to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(wavelengths) + self.spectral_density_vega(wavelengths.to(u.angstrom)))  # Convert to units of light
-                        return interpolate(w, wavelengths, light, left=0, right=0)
-                    return shift_and_interpolate
-        
-        self.vega_flux = define_data_scope(Table.read(self.config.template_filepath+'/'+self.config.vega_filename, format='ascii.ecsv'))
-
-        # Define astropy equivalency
-        def spectral_density_vega(w):
-
-            def converter_photlam(x):
-                return -2.5 * log10(x / self.vega_flux(w).value)
+        # Precompute vega spectral density in photlam once, on the fixed wavelength grid of the vega template
+        wavelengths, flux = Snapshot.read(self.config.template_filepath+'/'+self.config.vega_filename, _read_template_file)
+        self._vega_wavelengths = wavelengths.to(u.angstrom).value
+        self._vega_photlam = flux.to(self.photlam, equivalencies=u.spectral_density(wavelengths.to(u.angstrom))).value
+        # Conversion of a spectral density to photlam scales as a power of wavelength, used to redshift w/o converting again
+        unit_flux = 1 * flux.unit
+        self._vega_redshift_power = log2(unit_flux.to(self.photlam, equivalencies=u.spectral_density(2*u.angstrom)).value / unit_flux.to(self.photlam, equivalencies=u.spectral_density(1*u.angstrom)).value)
 
-            def iconverter_photlam(x):
-                return self.vega_flux(w).value * 10**(-0.4*x)
+        # Equivalency lists for recently used wavelengths
+        self._equivalency_cache = bounded_cache(self.config.equivalency_cache_size)
 
-            def converter_flam(x):
-                return converter_photlam((x*self.flam).to(self.photlam, equivalencies=u.spectral_density(w)).value)
 
-            def iconverter_flam(x):
-                return (iconverter_photlam(x)*self.photlam).to(self.flam, equivalencies=u.spectral_density(w)).value
+    def vega_flux(self, w):
+        # Spectral density of vega at w in photlam, redshifted by the source redshift
+        shift = 1 + self.redshift.to(u.dimensionless_unscaled).value
+        light = interpolate(u.Quantity(w, u.angstrom).value / shift, self._vega_wavelengths, self._vega_photlam, left=0, right=0) * shift**self._vega_redshift_power
+        return light * self.photlam
 
-            def converter_jy(x):
-                return converter_photlam((x*u.Jy).to(self.photlam, equivalencies=u.spectral_density(w)).value)
 
-            def iconverter_jy(x):
-                return (iconverter_photlam(x)*self.photlam).to(u.Jy, equivalencies=u.spectral_density(w)).value
+    def spectral_density_vega(self, w):
+        # Define astropy equivalency, evaluating vega flux and unit conversion factors at w once for all converters
+        vega = self.vega_flux(w).value
 
-            def converter_ab(x):
-                return converter_photlam(u.Quantity(x, u.AB).to(self.photlam, equivalencies=u.spectral_density(w)).value)
+        def converter_photlam(x):
+            return -2.5 * log10(x / vega)
 
-            def iconverter_ab(x):
-                return (iconverter_photlam(x)*self.photlam).to(u.AB, equivalencies=u.spectral_density(w)).value
+        def iconverter_photlam(x):
+            return vega * 10**(-0.4*x)
 
-            def converter_st(x):
-                return converter_photlam(u.Quantity(x, u.ST).to(self.photlam, equivalencies=u.spectral_density(w)).value)
+        def define_factor_scope(factor):  # Wrapper function to narrow the scope of factor, converting from a linear unit to photlam at w
+            def converter(x):
+                return converter_photlam(x * factor)
+            def iconverter(x):
+                return iconverter_photlam(x) / factor
+            return converter, iconverter
 
-            def iconverter_st(x):
-                return u.Quantity(iconverter_photlam(x), self.photlam).to(u.ST, equivalencies=u.spectral_density(w)).value
+        return [ (self.photlam, self.vegamag, converter_photlam, iconverter_photlam) ] + [
+            (unit, self.vegamag, *define_factor_scope((1 * unit).to(self.photlam, equivalencies=u.spectral_density(w)).value))
+            for unit in [self.flam, u.AB, u.Jy, u.ST]
+        ]
 
 
-            return [
-                    (self.photlam, self.vegamag, converter_photlam, iconverter_photlam),
-                    (self.flam, self.vegamag, converter_flam, iconverter_flam),
-                    (u.AB, self.vegamag, converter_ab, iconverter_ab),
-                    (u.Jy, self.vegamag, converter_jy, iconverter_jy),
-                    (u.ST, self.vegamag, converter_st, iconverter_st),
-                ]
-
-        self.spectral_density_vega = spectral_density_vega
+    def _equivalencies(self, wavelengths):
+        # Spectral density and vega equivalencies at wavelengths, memoized because they're rebuilt for the same wavelengths several times per request
+        wavelengths = wavelengths.to(u.angstrom)
+        key = (self.redshift.to(u.dimensionless_unscaled).value, wavelengths.shape, wavelengths.value.tobytes())
+        equivalencies = self._equivalency_cache.get(key)
+        if equivalencies is None:
+            equivalencies = u.spectral_density(wavelengths) + self.spectral_density_vega(wavelengths)
+            self._equivalency_cache.put(key, equivalencies)
+        return equivalencies
 
 
     def set_type(self, new_type):
@@ -166,18 +198,21 @@ class source:
                 warn(f'In Source.set_type() -- source type "{new_type}"" is not available', RuntimeWarning)
                 return
         self.type = new_type
-        self.active_parameters = list(vars(self.config.defaults).keys())
-        if self.type in vars(self.config.source_types).keys() and 'parameters' in vars(vars(self.config.source_types)[self.type]).keys():
-            self.__dict__.update({key: u.Quantity(val) for key, val in vars(vars(self.config.source_types)[self.type].parameters).items()})
-            self.active_parameters += list(vars(vars(self.config.source_types)[self.type].parameters).keys())
+        self.active_parameters = list(self.config.defaults.keys())
+        if self.type in self.config.source_types and 'parameters' in self.config.source_types[self.type]:
+            self.__dict__.update(self.config.source_types[self.type].parameters.items())
+            self.active_parameters += list(self.config.source_types[self.type].parameters.keys())
 
 
     def reset_parameters(self):
         
         self.type = self.config.defaults.type
         self.available_types = self._original_types.copy()
+        # Forget uploaded templates
+        if '_functions' in vars(self).keys():
+            self._functions = {key: val for key, val in self._functions.items() if key in self._original_types}
         self.set_flux(self.config.defaults.flux)
-        self.redshift = u.Quantity(self.config.defaults.redshift)
+        self.redshift = self.config.defaults.redshift
         self.wavelength_band = self.config.defaults.wavelength_band
 
 
@@ -187,7 +222,7 @@ class source:
 
         self._validate_config()
 
-        self._original_types = list(vars(self.config.source_types).keys())
+        self._original_types = list(self.config.source_types.keys())
 
         self.reset_parameters()
 
@@ -198,10 +233,18 @@ class source:
         self.set_type(self.type)
 
 
+    def fork(self):
+        # Copy that shares loaded data w/ this source, but whose parameters and uploaded templates are its own
+        forked = copy(self)
+        forked._functions = self._functions.copy()
+        forked.available_types = self.available_types.copy()
+        return forked
+
+
     def _emission(self, wavelengths):
-        central_wavelength = u.Quantity(vars(self.config.wavelength_band_options)[self.wavelength_band])
+        central_wavelength = self.config.wavelength_band_options[self.wavelength_band]
         sigma = self.width / (2 * sqrt(2 * log(2) ))
-        light = self.flux.to(self.photlam, equivalencies=u.spectral_density(wavelengths.to(u.angstrom)) + self.spectral_density_vega(wavelengths.to(u.angstrom))) / exp( (wavelengths - central_wavelength)**2/(2*sigma**2) )
+        light = self.flux.to(self.photlam, equivalencies=self._equivalencies(wavelengths.to(u.angstrom))) / exp( (wavelengths - central_wavelength)**2/(2*sigma**2) )
         return light
 
 
@@ -210,62 +253,68 @@ class source:
         wavelengths = wavelengths / (1 + self.redshift)  # Apply inverse redshift to get actual wavelengths
         light = (2*h*c**2 / wavelengths**5) / (exp(h*c/(wavelengths*self.temperature*k_B)) - 1)
         # Scale light by the given mag / wavelength
-        central_wavelength = u.Quantity(vars(self.config.wavelength_band_options)[self.wavelength_band])  # Get central wavelength of passband
-        light = light / interpolate(central_wavelength, wavelengths, light) * self.flux.to(self.photlam, equivalencies=u.spectral_density(central_wavelength) + self.spectral_density_vega(central_wavelength.to(u.angstrom)))  # Scale source by given mag/flux
+        central_wavelength = self.config.wavelength_band_options[self.wavelength_band]  # Get central wavelength of passband
+        light = light / interpolate(central_wavelength, wavelengths, light) * self.flux.to(self.photlam, equivalencies=self._equivalencies(central_wavelength))  # Scale source by given mag/flux
         return light
 
 
     def _flat(self, wavelengths):
         wavelengths = wavelengths / (1 + self.redshift)  # Apply inverse redshift to get actual wavelengths
-        return ([self.flux] * len(wavelengths) * self.flux.unit).to(self.photlam, equivalencies=u.spectral_density(wavelengths.to(u.angstrom)) + self.spectral_density_vega(wavelengths.to(u.angstrom)))
+        return ([self.flux] * len(wavelengths) * self.flux.unit).to(self.photlam, equivalencies=self._equivalencies(wavelengths.to(u.angstrom)))
 
 
     def _power_law(self, wavelengths):
         wavelengths = wavelengths / (1 + self.redshift)  # Apply inverse redshift to get actual wavelengths
-        central_wavelength = u.Quantity(vars(self.config.wavelength_band_options)[self.wavelength_band])
-        light = self.flux.to(self.photlam, equivalencies=u.spectral_density(wavelengths.to(u.angstrom)) + self.spectral_density_vega(wavelengths.to(u.angstrom))) * (wavelengths / central_wavelength) ** self.index
+        central_wavelength = self.config.wavelength_band_options[self.wavelength_band]
+        light = self.flux.to(self.photlam, equivalencies=self._equivalencies(wavelengths.to(u.angstrom))) * (wavelengths / central_wavelength) ** self.index
         return light
 
     
     def get_flux(self, wavelengths):
-        light = self._functions[self.type](wavelengths)
+        light = self._functions[self.type](self, wavelengths)
         # Check below is currently unecessary, I changed boundary handling to 0 instead of NaN -- but check w/ Sherry before deleting
         if isnan(light).any():
             warn('In source.get_flux() -- some or all provided wavelengths are outside the current bounds, returning NaN', RuntimeWarning)
-        return light.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(wavelengths.to(u.angstrom)) + self.spectral_density_vega(wavelengths.to(u.angstrom)))
+        return light.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=self._equivalencies(wavelengths.to(u.angstrom)))
 
     def add_template(self, template, name):
         # TODO -- input validation
-        if name.lower().endswith('.txt'):
-            template_string = b64decode(template).decode('utf-8').split('\n')
-            data = Table.read(template_string, format='ascii.ecsv')
-            for column in data.keys():
-                data.rename_column(column, column.upper())
-        elif name.lower().endswith('.fits'):
-            template_binary = b64decode(template)
-            data = Table.read(BytesIO(template_binary), format='fits')
-        else:
+        if not name.lower().endswith('.txt') and not name.lower().endswith('.fits'):
             raise ValueError('In source.add_template() -- Provided file must be either FITS or ASCII.ECSV format')
-        def define_data_scope(data):  # Wrapper function to narrow the scope of data and make sure each interpolation uses its own dataset
-            def scale_and_interpolate(w):
+        # Uploads are stored by a hash of their content, so uploading the same file again only costs a lookup, and reuses its cached spectra
+        key = (name.lower().split('.')[-1], sha1(template.encode('utf-8') if isinstance(template, str) else template).hexdigest())
+        data = self._templates.get(key)
+        if data is None:
+            data = self._read_template(template, name)
+            self._templates.put(key, data, size=0 if isinstance(data, Exception) else data[0].nbytes + data[1].nbytes)
+        def define_data_scope(data, key):  # Wrapper function to narrow the scope of data and make sure each interpolation uses its own dataset
+            def scale_and_interpolate(source, w):
                 try:
-                    wavelengths = data['WAVELENGTH'].to(u.angstrom) * (1 + self.redshift)  # Apply redshift
-                    light = data['FLUX'].to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(wavelengths) + self.spectral_density_vega(wavelengths.to(u.angstrom)))  # Convert to units of light
-                    central_wavelength = u.Quantity(vars(self.config.wavelength_band_options)[self.wavelength_band])  # Get central wavelength of passband
-                    light = light / interpolate(central_wavelength, wavelengths, light) * self.flux.to(u.photon / (u.cm**2 * u.s * u.angstrom), equivalencies=u.spectral_density(central_wavelength) + self.spectral_density_vega(central_wavelength.to(u.angstrom)))  # Scale source by given mag/flux
-                    return interpolate(w, wavelengths, light, left=0, right=0)
+                    if isinstance(data, Exception):
+                        raise data
+                    wavelengths, light = source._template_spectrum(key, data[0], data[1])
+                    return interpolate(w.to(u.angstrom).value, wavelengths, light, left=0, right=0) * u.photon / (u.cm**2 * u.s * u.angstrom)
                 except Exception as e:
                     raise ValueError('In source.add_template() -- provided SED is invalid, must have columns "WAVELENGTH" and "FLUX" with valid units specified\n' + str(e))
             return scale_and_interpolate
-        self._functions[name.split('.')[0]] = define_data_scope(data)  # Save function corresponding to this source
+        self._functions[name.split('.')[0]] = define_data_scope(data, key)  # Save function corresponding to this source
         if name.split('.')[0] not in self.available_types:
             self.available_types.append(name.split('.')[0])  # Add to list of types available to choose from
-        # Add name to config so that it's accessible
-        class GenericObject:
-            pass
-        obj = GenericObject()
-        obj.name = name.split('.')[0]
-        vars(self.config.source_types)[name.split('.')[0]] = obj
+
+    def _read_template(self, template, name):
+        # Return (wavelength, flux) quantities of an uploaded template, or the error to raise when it's used if its columns are invalid
+        if name.lower().endswith('.txt'):
+            template_string = b64decode(template).decode('utf-8').split('\n')
+            data = Table.read(template_string, format='ascii.ecsv')
+            for column in data.keys():
+                data.rename_column(column, column.upper())
+        else:
+            template_binary = b64decode(template)
+            data = Table.read(BytesIO(template_binary), format='fits')
+        try:
+            return data['WAVELENGTH'].quantity.to(u.angstrom), u.Quantity(data['FLUX'].quantity, dtype=float)
+        except Exception as e:
+            return e
 
     def set_flux(self, flux):
         if isinstance(flux, u.Quantity):
@@ -290,11 +339,11 @@ class source:
         if name == 'type':
             self.set_type(value)
         elif name == 'wavelength_band':
-            if str(value) in vars(self.config.wavelength_band_options).keys():
+            if str(value) in self.config.wavelength_band_options:
                 self.wavelength_band = str(value)
-            elif round(float(value)) * u.angstrom in u.Quantity([ u.Quantity(x) for x in vars(self.config.wavelength_band_options).values() ]):
-                names = list(vars(self.config.wavelength_band_options).keys())
-                wavelengths = [ u.Quantity(x) for x in vars(self.config.wavelength_band_options).values()] * u.angstrom
+            elif round(float(value)) * u.angstrom in u.Quantity(list(self.config.wavelength_band_options.values())):
+                names = list(self.config.wavelength_band_options.keys())
+                wavelengths = list(self.config.wavelength_band_options.values()) * u.angstrom
                 index = [round(x) for x in wavelengths.value.tolist()].index(round(float(value)))
                 self.wavelength_band = names[index]
             else: